@@ -128,9 +128,28 @@ name will exist. If we mistyped the strings, the bugs that it produces
 would be harder to find.
 """
 
-import sys, os, cmd, textwrap, time, threading, sys, random, colorama, pickle, datetime
+import sys, os, cmd, textwrap, time, threading, random, pickle, datetime, copy
+import socket, socketserver, struct, fcntl, zlib, json, marshal, hashlib, mmap
+import collections.abc, io, contextlib, re, array, shutil
+import colorama
 
-if len(sys.argv) < 4:
+try:
+    import numpy # optional, the NPC simulation uses it to work on every NPC at once
+except ImportError:
+    numpy = None
+
+"""
+The BBS starts a node as "adventure.py <user> <node> <ip>". Started as
+"adventure.py --<command> [args]" it does the job in __main__ that COMMAND
+names instead, so the arguments after it are never taken for a player.
+"""
+COMMAND = None
+COMMAND_ARGS = []
+if len(sys.argv) > 1 and sys.argv[1].startswith('--'):
+    COMMAND = sys.argv[1]
+    COMMAND_ARGS = sys.argv[2:]
+
+if COMMAND != None or len(sys.argv) < 4:
     USERNAME = 'Unknown User'
     NODENUMB = '0'
     USERIPAD = '127.0.0.1'
@@ -144,6 +163,33 @@ SAVES_FOLDER = '/mystic/scripts/adventure_saves/'
 if not os.path.exists(SAVES_FOLDER):
         os.makedirs(SAVES_FOLDER)
 
+# Every player online gets their own record file in here, so each node
+# only ever rewrites its own player and never the whole table.
+PLAYERS_FOLDER = '%s%s/' % (SAVES_FOLDER, 'players')
+
+if not os.path.exists(PLAYERS_FOLDER):
+        os.makedirs(PLAYERS_FOLDER)
+
+# Players whose node has not shown signs of life for PLAYER_TTL seconds (a
+# dropped connection never reaches removePlayer()) are evicted from the
+# shared table. Times are in seconds.
+PLAYER_TTL = 300
+HEARTBEAT_INTERVAL = 10
+EVICT_INTERVAL = 60
+
+# Optional local state server (run "adventure.py --server"). When it is
+# running, nodes share players, hits and boards through it instead of the
+# files in SAVES_FOLDER.
+STATE_SOCKET = '%s%s' % (SAVES_FOLDER, 'state.sock')
+
+# Each player has an append-only event log in here that other nodes add
+# their hits to. The owner watches it and reads from where it left off.
+EVENTS_FOLDER = '%s%s/' % (SAVES_FOLDER, 'events')
+EVENT_POLL_INTERVAL = 0.1
+
+if not os.path.exists(EVENTS_FOLDER):
+        os.makedirs(EVENTS_FOLDER)
+
 DESC = 'desc'
 NORTH = 'north'
 SOUTH = 'south'
@@ -151,6 +197,7 @@ EAST = 'east'
 WEST = 'west'
 UP = 'up'
 DOWN = 'down'
+DIRECTIONS = (NORTH, SOUTH, EAST, WEST, UP, DOWN)
 GROUND = 'ground'
 SHOP = 'shop'
 GROUNDDESC = 'grounddesc'
@@ -189,664 +236,662 @@ PURPLE = '\033[1;35;1m'
 CYAN = '\033[1;36;1m'
 WHITE = '\033[1;37;1m'
 
-worldRooms = {
-    'Town Square': {
-        DESC: 'The town square is a large open space with a fountain in the center. Streets lead in all directions. The town notice board stands here.',
-        NORTH: 'North Y Street',
-        EAST: 'East X Street',
-        SOUTH: 'South Y Street',
-        WEST: 'West X Street',
-        NOTICEBOARD: True,
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: ['Welcome Sign', 'Fountain']},
-    'North Y Street': {
-        DESC: 'The northern end of Y Street has really gone down hill. Pot holes are everywhere, as are stray cats, rats, and wombats.',
-        WEST: 'Thief Guild',
-        EAST: 'Bakery',
-        SOUTH: 'Town Square',
-        DOWN: 'North Y Sewer',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: ['Do Not Take Sign Sign']},
-    'Thief Guild': {
-        DESC: 'The Thief Guild is a dark den of unprincipled types. You clutch your purse (though several other people here would like to clutch your purse as well).',
-        SOUTH: 'West X Street',
-        EAST: 'North Y Street',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: ['Lock Picks', 'Silly Glasses']},
-    'Bakery': {
-        DESC: 'The delightful smell of meat pies fills the air, making you hungry. The baker flashes a grin, as he slides a box marked "Not Human Organs" under a table with his foot.',
-        WEST: 'North Y Street',
-        SOUTH: 'East X Street',
-        SHOP: ['Meat Pie', 'Donut', 'Bagel', 'Cupcake'],
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: ['Shop Howto']},
-    'Stone Mason': {
-        DESC: 'The Stone Mason is where you get your gravestone when you die.',
-        SOUTH: 'West Masons Alley',
-        SHOP: ['Gravestone'],
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: ['Shop Howto']},
-    'Hotel Entrance': {
-        DESC: 'The only hotel for miles around. You are at the entrance. There isn\'t a bellboy in sight.',
-        NORTH: 'Hotel Lobby',
-        SOUTH: 'East Masons Alley',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Hotel Lobby': {
-        DESC: 'You are in the hotel lobby. It\'s eerily quiet.',
-        NORTH: 'Elevator 1',
-        WEST: 'Hotel Restaurant',
-        EAST: 'Hotel Reception',
-        SOUTH: 'Hotel Entrance',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Elevator 1': {
-        DESC: 'Elevator on the 1st floor.',
-        SOUTH: 'Hotel Lobby',
-        UP: 'Elevator 2',
-        DOWN: 'Elevator B1',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Hotel Restaurant': {
-        DESC: 'You are in the hotel restaurant, looks like it\'s been closed for decades.',
-        EAST: 'Hotel Lobby',
-        SHOP: ['Meat Pie', 'Donut', 'Continental Breakfast', 'Cheese Board'],
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: ['Shop Howto']},
-    'Hotel Reception': {
-        DESC: 'You are in the hotel reception, Strange, there isn\'t anyone here. There is a guestbook on the desk, would you like to sign it?',
-        WEST: 'Hotel Lobby',
-        GUESTBOOK: True,
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Elevator 2': {
-        DESC: 'Elevator on the 2nd floor.',
-        WEST: 'Laundry Room 2',
-        EAST: 'Ice Machine 2',
-        SOUTH: 'Rooms 201-202',
-        UP: 'Elevator 3',
-        DOWN: 'Elevator 1',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Ice Machine 2': {
-        DESC: 'Ice Machine room on the 2nd floor.',
-        WEST: 'Elevator 2',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Laundry Room 2': {
-        DESC: 'Laundry room on the 2nd floor.',
-        EAST: 'Elevator 2',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Rooms 201-202': {
-        DESC: '',
-        WEST: 'Room 201',
-        EAST: 'Room 202',
-        NORTH: 'Elevator 2',
-        SOUTH: 'Rooms 203-204',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Rooms 203-204': {
-        DESC: '',
-        WEST: 'Room 203',
-        EAST: 'Room 204',
-        NORTH: 'Rooms 201-202',
-        SOUTH: 'Rooms 205-206',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Rooms 205-206': {
-        DESC: '',
-        WEST: 'Room 205',
-        EAST: 'Room 206',
-        NORTH: 'Rooms 203-204',
-        SOUTH: 'Rooms 207-208',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Rooms 207-208': {
-        DESC: '',
-        WEST: 'Room 207',
-        EAST: 'Room 208',
-        NORTH: 'Rooms 205-206',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 201': {
-        DESC: 'Room 201.',
-        EAST: 'Rooms 201-202',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 202': {
-        DESC: 'Room 202.',
-        WEST: 'Rooms 201-202',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 203': {
-        DESC: 'Room 203.',
-        EAST: 'Rooms 203-204',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 204': {
-        DESC: 'Room 204.',
-        WEST: 'Rooms 203-204',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 205': {
-        DESC: 'Room 205.',
-        EAST: 'Rooms 205-206',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 206': {
-        DESC: 'Room 206.',
-        WEST: 'Rooms 205-206',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 207': {
-        DESC: 'Room 207.',
-        EAST: 'Rooms 207-208',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 208': {
-        DESC: 'Room 208.',
-        WEST: 'Rooms 207-208',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Elevator 3': {
-        DESC: 'Elevator on the 3rd floor.',
-        WEST: 'Laundry Room 3',
-        EAST: 'Ice Machine 3',
-        SOUTH: 'Rooms 301-302',
-        DOWN: 'Elevator 2',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Ice Machine 3': {
-        DESC: 'Ice Machine room on the 3rd floor.',
-        WEST: 'Elevator 3',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Laundry Room 3': {
-        DESC: 'Laundry room on the 3rd floor.',
-        EAST: 'Elevator 3',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Rooms 301-302': {
-        DESC: '',
-        WEST: 'Room 301',
-        EAST: 'Room 302',
-        NORTH: 'Elevator 3',
-        SOUTH: 'Rooms 303-304',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Rooms 303-304': {
-        DESC: '',
-        WEST: 'Room 303',
-        EAST: 'Room 304',
-        NORTH: 'Rooms 301-302',
-        SOUTH: 'Rooms 305-306',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Rooms 305-306': {
-        DESC: '',
-        WEST: 'Room 305',
-        EAST: 'Room 306',
-        NORTH: 'Rooms 303-304',
-        SOUTH: 'Rooms 307-308',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Rooms 307-308': {
-        DESC: '',
-        WEST: 'Room 307',
-        EAST: 'Room 308',
-        NORTH: 'Rooms 305-306',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 301': {
-        DESC: 'Room 301.',
-        EAST: 'Rooms 301-302',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 302': {
-        DESC: 'Room 302.',
-        WEST: 'Rooms 301-302',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 303': {
-        DESC: 'Room 303.',
-        EAST: 'Rooms 303-304',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 304': {
-        DESC: 'Room 304.',
-        WEST: 'Rooms 303-304',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 305': {
-        DESC: 'Room 305.',
-        EAST: 'Rooms 305-306',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 306': {
-        DESC: 'Room 306.',
-        WEST: 'Rooms 305-306',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 307': {
-        DESC: 'Room 307.',
-        EAST: 'Rooms 307-308',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Room 308': {
-        DESC: 'Room 308.',
-        WEST: 'Rooms 307-308',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Elevator B1': {
-        DESC: 'Elevator on the Upper Basement (B1) floor.',
-        UP: 'Elevator 1',
-        DOWN: 'Elevator B2',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Elevator B2': {
-        DESC: 'Elevator on the Lower Basement (B2) floor.',
-        UP: 'Elevator B1',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'West Masons Alley': {
-        DESC: '',
-        NORTH: 'Stone Mason',
-        EAST: 'East Masons Alley',
-        WEST: 'East X Street',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'East Masons Alley': {
-        DESC: '',
-        NORTH: 'Hotel Entrance',
-        WEST: 'West Masons Alley',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'West X Street': {
-        DESC: 'West X Street is the rich section of town. So rich, they paved the streets with gold. This probably was not a good idea. The thief guild opened up the next day.',
-        NORTH: 'Thief Guild',
-        EAST: 'Town Square',
-        SOUTH: 'Blacksmith',
-        WEST: 'Used Anvils Store',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Used Anvils Store': {
-        DESC: 'The anvil store has anvils of all types and sizes, each previously-owned but still in servicable condition. However, due to a bug in the way this game is designed, you can buy anvils like any other item and walk around, but if you drop them they cannot be picked up since their TAKEABLE value is set to False. The code should be changed so that it\'s not possible for shops to sell items with TAKEABLE set to False.',
-        EAST: 'West X Street',
-        SHOP: ['Anvil'],
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: ['Shop Howto', 'Anvil', 'Anvil', 'Anvil', 'Anvil']},
-    'East X Street': {
-        DESC: 'East X Street. It\'s like X Street, except East.',
-        NORTH: 'Bakery',
-        EAST: 'West Masons Alley',
-        WEST: 'Town Square',
-        SOUTH: 'Wizard Tower',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Blacksmith': {
-        DESC: 'The blacksmith loudly hammers a new sword over her anvil. Swords, axes, butter knives all line the walls of her workshop, available for a price.',
-        NORTH: 'West X Street',
-        EAST: 'South Y Street',
-        SHOP: ['Sword', 'Great Sword', 'War Axe', 'Chainmail T-Shirt'],
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: ['Anvil', 'Shop Howto']},
-    'South Y Street': {
-        DESC: 'The Christmas Carolers of South Y Street are famous for all legally changing their name to Carol. They are also famous for singing year-round, in heavy fur coats and wool mittens, even in the summer. That\'s dedication to their craft!',
-        NORTH: 'Town Square',
-        WEST: 'Blacksmith',
-        DOWN: 'South Y Sewer',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Wizard Tower': {
-        DESC: 'Zanny magical antics are afoot in the world-famous Wizard Tower. Cauldrons bubble, rats talk, and books float midair in this center of magical discovery.',
-        NORTH: 'East X Street',
-        UP: 'Observation Deck',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: ['Crystal Ball', 'Floating Book', 'Floating Book']},
-    'Observation Deck': {
-        DESC: 'You can see the entire town from the top of the Wizard Tower. Everybody looks like ants, especially the people transformed into ants by the wizards of the tower!',
-        DOWN: 'Wizard Tower',
-        UP: 'Magical Escalator to Nowhere',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: ['Telescope']},
-    'Magical Escalator to Nowhere': {
-        DESC: 'No matter how much you climb the escalator, it doesn\'t seem to be getting you anywhere. You can see a visitors guest book.',
-        UP: 'Magical Escalator to Nowhere',
-        DOWN: 'Observation Deck',
-        GUESTBOOK: True,
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'North Y Sewer': {
-        DESC: 'The sewer in North Y Street is overrun with rats and sewage. This had better be worth it.',
-        UP: 'North Y Street',
-        EAST: 'Bakery Sewer',
-        WEST: 'Thief Guild Sewer',
-        SOUTH: 'Town Square Sewer',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Town Square Sewer': {
-        DESC: 'The sewer underneath the town square.',
-        NORTH: 'North Y Sewer',
-        SOUTH: 'South Y Sewer',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'South Y Sewer': {
-        DESC: 'The sewer in South Y Street is relatively clean for a sewer. It looks like it has been well looked after, and there are signs that this has been used for things other than just waste.',
-        UP: 'South Y Street',
-        NORTH: 'Town Square Sewer',
-        WEST: 'Blacksmith Sewer',
-        EAST: 'Wizard Tower Sewer',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Bakery Sewer': {
-        DESC: 'The sewer beneath the Bakery. Is that bread you can smell?',
-        EAST: 'Stone Mason Sewer',
-        WEST: 'North Y Sewer',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Stone Mason Sewer': {
-        DESC: 'The sewer beneath the Stone Mason. Shhhh, there\'s a ghost here.',
-        WEST: 'Bakery Sewer',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Thief Guild Sewer': {
-        DESC: 'The sewer beneath the Thief Guild building. Unsurprisingly there\'s a distinct chance this area has been looted already.',
-        EAST: 'North Y Sewer',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Blacksmith Sewer': {
-        DESC: 'The sewer beneath the Blacksmith building. The blacksmith definitely has enough iron in his diet.',
-        EAST: 'South Y Sewer',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    'Wizard Tower Sewer': {
-        DESC: 'The sewer beneath the Wizard Tower. Even this brown sludge smells magical.',
-        WEST: 'South Y Sewer',
-        NPC: [],
-        OTHERPLAYERS: [],
-        GROUND: []},
-    }
-
-worldItems = {
-    'Money': {
-        GROUNDDESC: 'A coin is lying on the ground',
-        SHORTDESC: 'a coin',
-        LONGDESC: 'The local currency used in the game',
-        SELLABLE: False,
-        TYPE: 'playerStats',
-        DESCWORDS: ['money', 'coin']},
-    'Welcome Sign': {
-        GROUNDDESC: 'A welcome sign stands here.',
-        SHORTDESC: 'a welcome sign',
-        LONGDESC: 'The welcome sign reads, "Welcome to this text adventure demo. You can type "help" for a list of commands to use. Be sure to check out Al\'s cool programming books at http://inventwithpython.com"',
-        TAKEABLE: False,
-        SELL: 0,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['welcome', 'sign']},
-    'Do Not Take Sign Sign': {
-        GROUNDDESC: 'A sign stands here, not bolted to the ground.',
-        SHORTDESC: 'a sign',
-        LONGDESC: 'The sign reads, "Do Not Take This Sign"',
-        SELL: 100,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['sign']},
-    'Fountain': {
-        GROUNDDESC: 'A bubbling fountain of green water.',
-        SHORTDESC: 'a fountain',
-        LONGDESC: 'The water in the fountain is a bright green color. Is that... gatorade?',
-        TAKEABLE: False,
-        TYPE: 'inventory',
-        DESCWORDS: ['fountain']},
-    'Sword': {
-        GROUNDDESC: 'A sword lies on the ground.',
-        SHORTDESC: 'a sword',
-        LONGDESC: 'A longsword, engraved with the word, "Used". Has 20 DAMAGE',
-        SELL: 10,
-        SELLABLE: True,
-        DAMAGE: 20,
-        TYPE: 'inventory',
-        DESCWORDS: ['sword', 'longsword']},
-    'Great Sword': {
-        GROUNDDESC: 'A great sword lies on the ground.',
-        SHORTDESC: 'a great sword',
-        LONGDESC: 'A longsword, engraved with the word, "Excaleber". Has 40 DAMAGE',
-        COST: 100,
-        SELL: 50,
-        SELLABLE: True,
-        DAMAGE: 40,
-        TYPE: 'inventory',
-        DESCWORDS: ['sword', 'excaleber', 'longsword']},
-    'War Axe': {
-        GROUNDDESC: 'A mighty war axe lies on the ground.',
-        SHORTDESC: 'a war axe',
-        LONGDESC: 'The mighty war axe is made with antimony impurities from a fallen star, rendering it surpassingly brittle. Has 50 DAMAGE',
-        COST: 150,
-        SELL: 75,
-        SELLABLE: True,
-        DAMAGE: 50,
-        TYPE: 'inventory',
-        DESCWORDS: ['axe', 'war', 'mighty']},
-    'Chainmail T-Shirt': {
-        GROUNDDESC: 'A chainmail t-shirt lies wadded up on the ground.',
-        SHORTDESC: 'a chainmail t-shirt',
-        LONGDESC: 'The chainmail t-shirt has a slogan and arrow engraved on the front: "I\'m with Stupid"',
-        SELL: 5,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['chainmail', 'chain', 'mail', 't-shirt', 'tshirt', 'stupid']},
-    'Anvil': {
-        GROUNDDESC: 'The blacksmith\'s anvil, far too heavy to pick up, rests in the corner.',
-        SHORTDESC: 'an anvil',
-        LONGDESC: 'The black anvil has the word "ACME" engraved on the side.',
-        TAKEABLE: False,
-        COST: 10,
-        SELL: 10,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['anvil']},
-    'Lock Picks': {
-        GROUNDDESC: 'A set of lock picks lies on the ground.',
-        SHORTDESC: 'a set of lock picks',
-        LONGDESC: 'A set of fine picks for picking locks.',
-        SELL: 10,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['lockpicks', 'picks', 'set']},
-    'Silly Glasses': {
-        GROUNDDESC: 'A pair of those silly gag glasses with the nose and fake mustache rest on the ground.',
-        SHORTDESC: 'a pair of silly fake mustache glasses',
-        LONGDESC: 'These glasses have a fake nose and mustache attached to them. The perfect disguise!',
-        SELL: 1,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['glasses', 'silly', 'fake', 'mustache']},
-    'Meat Pie': {
-        GROUNDDESC: 'A suspicious meat pie rests on the ground.',
-        SHORTDESC: 'a meat pie',
-        LONGDESC: 'A meat pie. It tastes like chicken.',
-        EDIBLE: True,
-        GAIN: 30,
-        COST: 3,
-        SELL: 2,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['pie', 'meat']},
-    'Continental Breakfast': {
-        GROUNDDESC: 'A continental breakfast rests on the ground. It looks like it was placed there suspiciously.',
-        SHORTDESC: 'a large breakfast',
-        LONGDESC: 'A continental breakfast, includes sausages, scrambled egg, bacon, hash browns and all the trimmings.',
-        EDIBLE: True,
-        GAIN: 50,
-        COST: 10,
-        SELL: 1,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['breakfast']},
-    'Cheese Board': {
-        GROUNDDESC: 'A cheese board is scattered on the ground, looks like it was thrown. Crumbs!',
-        SHORTDESC: 'a large mess of cheese',
-        LONGDESC: 'A cheese board with all kinds of cheeses and crackers.',
-        EDIBLE: True,
-        GAIN: 20,
-        COST: 5,
-        SELL: 1,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['cheese']},
-    'Bagel': {
-        GROUNDDESC: 'A bagel rests on the ground. (Gross.)',
-        SHORTDESC: 'a bagel',
-        LONGDESC: 'It is a donut-shaped bagel.',
-        EDIBLE: True,
-        GAIN: 10,
-        COST: 2,
-        SELL: 1,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['bagel']},
-    'Donut': {
-        GROUNDDESC: 'A donut rests on the ground. (Gross.)',
-        SHORTDESC: 'a donut',
-        LONGDESC: 'It is a bagel-shaped donut.',
-        EDIBLE: True,
-        GAIN: 10,
-        COST: 2,
-        SELL: 1,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['donut']},
-    'Cupcake': {
-        GROUNDDESC: 'A cupcake rests on the ground. (Gross.)',
-        SHORTDESC: 'A cupcake',
-        LONGDESC: 'It is a cupcake shaped cupcake',
-        EDIBLE: True,
-        GAIN: 20,
-        COST: 2,
-        SELL: 1,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['cupcake']},
-    'Crystal Ball': {
-        GROUNDDESC: 'A glowing crystal ball rests on a small pillow.',
-        SHORTDESC: 'a crystal ball',
-        LONGDESC: 'The crystal ball swirls with mystical energy, forming the words "Answer Unclear. Check Again Later."',
-        SELL: 10,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['crystal', 'ball']},
-    'Floating Book': {
-        GROUNDDESC: 'A magical book floats here.',
-        SHORTDESC: 'a floating book',
-        LONGDESC: 'This magical tomb doesn\'t have a lot of pictures in it. Boring!',
-        SELL: 5,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['book', 'floating']},
-    'Telescope': {
-        GROUNDDESC: 'A telescope is bolted to the ground.',
-        SHORTDESC: 'a telescope',
-        LONGDESC: 'Using the telescope, you can see your house from here!',
-        TAKEABLE: False,
-        TYPE: 'inventory',
-        DESCWORDS: ['telescope']},
-    'README Note': {
-        GROUNDDESC: 'A note titled "README" rests on the ground.',
-        SHORTDESC: 'a README note',
-        LONGDESC: 'The README note reads, "Welcome to the text adventure demo. Be sure to check out the source code to see how this game is put together."',
-        SELL: 1,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['readme', 'note']},
-    'Shop Howto': {
-        GROUNDDESC: 'A "Shopping HOWTO" note rests on the ground.',
-        SHORTDESC: 'a shopping howto',
-        LONGDESC: 'The note reads, "When you are at a shop, you can type "list" to show what is for sale. "buy <item>" will add it to your inventory, or you can value and sell an item in your inventory with "value <item>" and "sell <item>". Every item has a lower resale value than it\'s original purchase price.',
-        EDIBLE: True,
-        SELL: 1,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['howto', 'note', 'shop']},
-    'Gravestone': {
-        GROUNDDESC: 'A new gravestone.',
-        SHORTDESC: 'A gravestone',
-        LONGDESC: 'This is a gravestone. You can buy one now for your grave when you die.',
-        COST: 100,
-        SELL: 90,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['gravestone', 'headstone']},
-    'Moneybag': {
-        GROUNDDESC: 'A money bag is lying on the ground',
-        SHORTDESC: 'a bag full of money',
-        LONGDESC: 'The local currency used in the game',
-        COST: 100,
-        SELL: 100,
-        SELLABLE: True,
-        TYPE: 'inventory',
-        DESCWORDS: ['moneybag', 'coins']},
-    }
+"""
+The rooms, items and NPCs live in world.json next to this file, so the world
+can be changed without touching the code. Setting ADVENTURE_WORLD to the path
+of another world file, such as one made by generateWorld(), plays that one.
+
+Almost all of the world is text that never changes: descriptions, exits and
+item names. Rather than every node holding its own copy, the build puts
+that text in WORLD_ASSET, which each node maps read only, so however many
+nodes are running the text is only in memory once, in the page cache. Each
+room and item becomes a WorldRecord, which reads its text from the asset
+and keeps everything that can change (ground, NPCs, shop, flags) itself.
+
+Records are CompactRecords: they behave as dicts, so worldRooms[loc][GROUND]
+works as it always has, but the values every room, item or NPC has live in
+__slots__ rather than in a dict per record. Names, both the keys of the
+world and those in its lists, are interned, so every 'Do Not Take Sign Sign'
+is the same string and comparing them is usually just an identity check.
+
+The rest of the split world is kept in WORLD_CACHE as a marshal of
+(sha1 of world.json, world), so a node starting up neither parses the JSON
+nor splits it again. A cache or asset made from a different world.json is
+ignored and both are rebuilt, so editing the world is all it takes;
+"adventure.py --build-world" rebuilds them up front, for instance before the
+BBS starts its nodes. The asset is replaced rather than rewritten, so nodes
+already running keep the one they mapped.
+"""
+TOWN_WORLD_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'world.json')
+WORLD_FILE = os.environ.get('ADVENTURE_WORLD', TOWN_WORLD_FILE)
+WORLD_CACHE = '%s.cache' % (WORLD_FILE)
+WORLD_ASSET = '%s.asset' % (WORLD_FILE)
+WORLD_ASSET_MAGIC = b'ADVWORLD'
+WORLD_ASSET_HEADER = struct.Struct('>8s20sII') # magic, sha1 of world.json, record count, field count
+WORLD_ASSET_RECORD = struct.Struct('>II') # first field, field count
+WORLD_ASSET_FIELD = struct.Struct('>HII') # key, offset of the text, length of the text
+worldAsset = None
+worldAssetKeys = []
+worldAssetFields = 0
+worldAssetText = 0
+
+class CompactRecord(collections.abc.MutableMapping):
+    """A record that behaves as a dict but keeps the values named in SLOTS
+    in __slots__, and anything else in a dict that is only made if needed"""
+    __slots__ = ('id', 'extra')
+    SLOTS = {}
+
+    def __init__(self, recordId, values):
+        self.id = recordId
+        self.extra = None
+        for key in values:
+            self[key] = values[key]
+
+    def storedKeys(self):
+        for key in self.SLOTS:
+            if hasattr(self, self.SLOTS[key]):
+                yield key
+        if self.extra != None:
+            for key in self.extra:
+                yield key
+
+    # __getitem__, __contains__ and get are written out rather than left
+    # to MutableMapping, which would go through __getitem__ and an exception
+    # for each of them.
+    def __getitem__(self, key):
+        slot = self.SLOTS.get(key)
+        if slot != None:
+            try:
+                return getattr(self, slot)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra != None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        slot = self.SLOTS.get(key)
+        if slot != None:
+            return hasattr(self, slot)
+        return self.extra != None and key in self.extra
+
+    def get(self, key, default=None):
+        slot = self.SLOTS.get(key)
+        if slot != None:
+            return getattr(self, slot, default)
+        if self.extra != None:
+            return self.extra.get(key, default)
+        return default
+
+    def __setitem__(self, key, value):
+        slot = self.SLOTS.get(key)
+        if slot != None:
+            setattr(self, slot, value)
+        else:
+            if self.extra == None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        slot = self.SLOTS.get(key)
+        if slot != None:
+            try:
+                delattr(self, slot)
+            except AttributeError:
+                raise KeyError(key)
+        elif self.extra != None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return self.storedKeys()
+
+    def __len__(self):
+        return len(list(self.__iter__()))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class WorldRecord(CompactRecord):
+    """A room or item that reads its text from the world asset and keeps
+    everything else itself. The record's field table is read from the asset
+    the first time any of its text is wanted and kept in table as
+    {key: (offset, length)}, so later reads are a dict lookup and a slice.
+    A table costs about 500 bytes, which only the records whose text has
+    been read pay."""
+    __slots__ = ('record', 'table')
+
+    def __init__(self, recordId, record, values):
+        self.record = record
+        self.table = None
+        CompactRecord.__init__(self, recordId, values)
+
+    def fields(self):
+        """Returns {key: (offset, length)} for the text of this record in the asset"""
+        if self.table == None:
+            table = {}
+            first, count = WORLD_ASSET_RECORD.unpack_from(worldAsset, WORLD_ASSET_HEADER.size + self.record * WORLD_ASSET_RECORD.size)
+            for field in WORLD_ASSET_FIELD.iter_unpack(worldAsset[worldAssetFields + first * WORLD_ASSET_FIELD.size:worldAssetFields + (first + count) * WORLD_ASSET_FIELD.size]):
+                table[worldAssetKeys[field[0]]] = field[1:]
+            self.table = table
+        return self.table
+
+    def text(self, key):
+        offset, length = self.fields()[key]
+        return worldAsset[worldAssetText + offset:worldAssetText + offset + length].decode('utf-8')
+
+    def __getitem__(self, key):
+        slot = self.SLOTS.get(key)
+        if slot != None:
+            try:
+                return getattr(self, slot)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra != None and key in self.extra:
+            return self.extra[key]
+        return self.text(key) # text in the asset can be overridden but never removed, so __delitem__ is left alone
+
+    # The values in SLOTS are never text, so asking for one that isn't
+    # there doesn't read the field table.
+    def __contains__(self, key):
+        if CompactRecord.__contains__(self, key):
+            return True
+        return key not in self.SLOTS and key in self.fields()
+
+    def get(self, key, default=None):
+        if CompactRecord.__contains__(self, key):
+            return CompactRecord.__getitem__(self, key)
+        if key not in self.SLOTS and key in self.fields():
+            return self.text(key)
+        return default
+
+    def __iter__(self):
+        stored = set(self.storedKeys())
+        for name in self.fields():
+            if name not in stored:
+                yield name
+        for name in stored:
+            yield name
+
+class RoomRecord(WorldRecord):
+    __slots__ = ('ground', 'npc', 'shop', 'otherplayers', 'noticeboard', 'guestbook')
+    SLOTS = {GROUND: 'ground', NPC: 'npc', SHOP: 'shop', OTHERPLAYERS: 'otherplayers', NOTICEBOARD: 'noticeboard', GUESTBOOK: 'guestbook'}
+
+class ItemRecord(WorldRecord):
+    __slots__ = ('descwords', 'takeable', 'edible', 'sellable', 'sell', 'cost', 'damage', 'gain')
+    SLOTS = {DESCWORDS: 'descwords', TAKEABLE: 'takeable', EDIBLE: 'edible', SELLABLE: 'sellable', SELL: 'sell', COST: 'cost', DAMAGE: 'damage', GAIN: 'gain'}
+
+class NPCColumns(object):
+    """The health, XP, HP and room id of every NPC, indexed by NPC id, in
+    numpy arrays if numpy is there and in array.arrays if not. room is -1
+    for an NPC that isn't in a room the simulation knows of. written holds
+    the ids of the NPCs whose records have been set since they were made."""
+
+    def __init__(self, count):
+        for column in ('health', 'maxHealth', 'xp', 'hp', 'room'):
+            if numpy != None:
+                setattr(self, column, numpy.zeros(count, dtype=numpy.int64))
+            else:
+                setattr(self, column, array.array('q', [0]) * count)
+        for npcId in range(count):
+            self.room[npcId] = -1
+        self.written = set()
+
+def npcColumn(column):
+    """A property for an NPCRecord value kept in its NPCColumns"""
+    def get(self):
+        return int(getattr(self.columns, column)[self.id]) # a plain int, so saves never hold numpy types
+    def set(self, value):
+        getattr(self.columns, column)[self.id] = value
+    return property(get, set)
+
+class NPCRecord(CompactRecord):
+    __slots__ = ('columns', 'items', 'money', 'descwords')
+    SLOTS = {'Inventory': 'inventory', 'Health': 'health', 'XP': 'xp', 'HP': 'hp', 'Money': 'money', DESCWORDS: 'descwords'}
+    health = npcColumn('health')
+    xp = npcColumn('xp')
+    hp = npcColumn('hp')
+
+    def __init__(self, recordId, columns, values):
+        self.columns = columns
+        CompactRecord.__init__(self, recordId, values)
+        columns.written.discard(recordId)
+
+    def __setitem__(self, key, value):
+        CompactRecord.__setitem__(self, key, value)
+        self.columns.written.add(self.id)
+
+    def __delitem__(self, key):
+        CompactRecord.__delitem__(self, key)
+        self.columns.written.add(self.id)
+
+    # The inventory is made an ItemList the first time it is read after
+    # being set, as the world is loaded before ItemList can be used.
+    def getInventory(self):
+        if not isinstance(self.items, ItemList):
+            self.items = ItemList(self.items)
+        return self.items
+
+    def setInventory(self, items):
+        self.items = items
+
+    def delInventory(self):
+        del self.items
+
+    inventory = property(getInventory, setInventory, delInventory)
+
+def internValues(values):
+    """Returns values with the names in any lists in it interned"""
+    for key in values:
+        if isinstance(values[key], list):
+            values[key] = [sys.intern(value) if isinstance(value, str) else value for value in values[key]]
+    return values
+
+def compactWorld(world):
+    """Turns each room, item and NPC in world into a record whose id is its
+    place in the world, keyed by its interned name. The NPCs' health, XP,
+    HP and room go in world['npcColumns']."""
+    world['npcColumns'] = NPCColumns(len(world['NPCs']))
+    for kind, recordClass in (('worldRooms', RoomRecord), ('worldItems', ItemRecord), ('NPCs', NPCRecord)):
+        records = {}
+        for recordId, name in enumerate(world[kind]):
+            entry = world[kind][name]
+            if recordClass == NPCRecord:
+                records[sys.intern(name)] = NPCRecord(recordId, world['npcColumns'], internValues(entry))
+                world['npcColumns'].maxHealth[recordId] = entry['Health']
+            elif isinstance(entry, tuple):
+                records[sys.intern(name)] = recordClass(recordId, entry[0], internValues(entry[1]))
+            else:
+                records[sys.intern(name)] = internValues(entry) # no asset, so it stays a plain dict
+        world[kind] = records
+    return world
+
+def splitWorld(world):
+    """Moves the text of the rooms and items in world out into the bytes of
+    an asset, leaving (record, overlay) in their place"""
+    keys = []
+    records = []
+    fields = []
+    text = bytearray()
+    for kind in ('worldRooms', 'worldItems'):
+        for name in world[kind]:
+            overlay = {}
+            first = len(fields)
+            for key, value in world[kind][name].items():
+                if isinstance(value, str):
+                    if key not in keys:
+                        keys.append(key)
+                    data = value.encode('utf-8')
+                    fields.append(WORLD_ASSET_FIELD.pack(keys.index(key), len(text), len(data)))
+                    text += data
+                else:
+                    overlay[key] = value
+            world[kind][name] = (len(records), overlay)
+            records.append(WORLD_ASSET_RECORD.pack(first, len(fields) - first))
+    world['assetKeys'] = keys
+    return world, b''.join(records), b''.join(fields), bytes(text)
+
+"""
+goto and route find their way with a next-hop table built along with the
+world cache, so it is only worked out again when world.json changes. For
+every pair of rooms it holds the direction of the first step of a shortest
+way from one to the other, so a route is just a walk through the table. It
+holds the square of the number of rooms, so bigger worlds than
+ROUTE_TABLE_MAX_ROOMS skip it and work out the row for a destination when
+one is asked for, keeping the last few.
+"""
+ROUTE_TABLE_MAX_ROOMS = 4096
+ROUTE_HERE = 254
+ROUTE_NONE = 255
+
+def buildRouteRow(names, ids, comesFrom, dest):
+    """Returns a bytearray of the direction to step in from each room
+    towards dest, found by a breadth first search back from dest"""
+    row = bytearray([ROUTE_NONE]) * len(names)
+    row[dest] = ROUTE_HERE
+    queue = [dest]
+    for room in queue:
+        for source, direction in comesFrom[room]:
+            if row[source] == ROUTE_NONE:
+                row[source] = direction
+                queue.append(source)
+    return row
+
+def routeGraph(rooms, names=None):
+    """Returns the room names, their ids and, for each room, the
+    (room, direction) pairs that lead into it"""
+    if names == None:
+        names = list(rooms)
+    ids = dict((name, roomId) for roomId, name in enumerate(names))
+    comesFrom = [[] for name in names]
+    for roomId, name in enumerate(names):
+        for direction, key in enumerate(DIRECTIONS):
+            if rooms[name].get(key) in ids:
+                comesFrom[ids[rooms[name][key]]].append((roomId, direction))
+    return names, ids, comesFrom
+
+def buildRoutes(rooms):
+    """Returns the next-hop table for rooms, a row for each destination, or None if there are too many rooms"""
+    if len(rooms) > ROUTE_TABLE_MAX_ROOMS:
+        return None
+    names, ids, comesFrom = routeGraph(rooms)
+    table = bytearray()
+    for dest in range(len(names)):
+        table += buildRouteRow(names, ids, comesFrom, dest)
+    return bytes(table)
+
+def buildWorld(source, digest):
+    """Parses world.json, writes WORLD_ASSET and WORLD_CACHE from it and
+    returns the split world, or the plain one if they could not be written"""
+    world = json.loads(source.decode('utf-8'))
+    routes = buildRoutes(world['worldRooms'])
+    split, records, fields, text = splitWorld(world)
+    split['routes'] = routes
+    try:
+        file_temp = '%s.%s.tmp' % (WORLD_ASSET, os.getpid())
+        with open(file_temp, 'wb') as f:
+            f.write(WORLD_ASSET_HEADER.pack(WORLD_ASSET_MAGIC, bytes.fromhex(digest), len(records) // WORLD_ASSET_RECORD.size, len(fields) // WORLD_ASSET_FIELD.size))
+            f.write(records)
+            f.write(fields)
+            f.write(text)
+        os.replace(file_temp, WORLD_ASSET)
+
+        file_temp = '%s.%s.tmp' % (WORLD_CACHE, os.getpid())
+        with open(file_temp, 'wb') as f:
+            marshal.dump((digest, split), f)
+        os.replace(file_temp, WORLD_CACHE)
+    except OSError:
+        return json.loads(source.decode('utf-8')) # a node that can't write them still plays, with its own copy of the text
+    return split
+
+def mapWorldAsset(digest):
+    """Maps WORLD_ASSET, returning False if it is missing or was built from a different world.json"""
+    global worldAsset
+    global worldAssetFields
+    global worldAssetText
+
+    try:
+        with open(WORLD_ASSET, 'rb') as f:
+            asset = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, assetDigest, recordCount, fieldCount = WORLD_ASSET_HEADER.unpack_from(asset)
+    except (OSError, ValueError, struct.error):
+        return False
+    if magic != WORLD_ASSET_MAGIC or assetDigest != bytes.fromhex(digest):
+        asset.close()
+        return False
+    worldAsset = asset
+    worldAssetFields = WORLD_ASSET_HEADER.size + recordCount * WORLD_ASSET_RECORD.size
+    worldAssetText = worldAssetFields + fieldCount * WORLD_ASSET_FIELD.size
+    return True
+
+def loadWorld():
+    """Returns the world, with its rooms and items reading their text from
+    WORLD_ASSET, rebuilding the asset and WORLD_CACHE if they are out of date"""
+    global worldAssetKeys
+
+    with open(WORLD_FILE, 'rb') as f:
+        source = f.read()
+    digest = hashlib.sha1(source).hexdigest()
+    world = None
+    try:
+        with open(WORLD_CACHE, 'rb') as f:
+            cachedDigest, cached = marshal.loads(f.read())
+        if cachedDigest == digest and mapWorldAsset(digest) == True:
+            world = cached
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    if world == None:
+        world = buildWorld(source, digest)
+        if 'assetKeys' not in world:
+            return compactWorld(world)
+        if mapWorldAsset(digest) == False:
+            return compactWorld(json.loads(source.decode('utf-8')))
+
+    worldAssetKeys = world['assetKeys']
+    return compactWorld(world)
+
+"""
+A world generator, for seeing how the game copes with far bigger worlds
+than the town. It starts from the town in TOWN_WORLD_FILE, adds hotel floors
+above the third, each laid out like the others (an elevator, a laundry room,
+an ice machine, a corridor and rooms X01 to X08), until half the rooms are
+hotel, and fills the rest with a grid of sewer tunnels reached from the
+Town Square Sewer. Rooms sometimes have an item lying in them, and there is
+a copy of one of the town's NPCs for every hundred rooms. The same number
+of rooms and seed always give the same world.
+
+The hotel floors and the tunnels are made from room templates, a dict
+saying which template and how many floors or tunnels, so a world can carry
+the templates in its "roomTemplates" instead of the rooms themselves. Its
+worldRooms is then a TemplatedRooms, which only makes a room when something
+first asks for it, so a hotel a thousand floors high costs nothing until
+someone goes up in the elevator. A made room that has not been drawn for
+TEMPLATE_ROOM_TTL seconds, has no one in it and is just as its template
+made it is thrown away again by evictTemplateRooms(). Rooms from templates
+are not part of the route table, so goto and route find the way to or from
+one with a breadth first search that reads the exits from the templates
+without making the rooms, and gives up after ROUTE_SEARCH_MAX_ROOMS rooms.
+
+"adventure.py --generate-world <rooms> [seed] [file] [--lazy]" writes a
+world, with templates rather than rooms if --lazy is given, and
+"adventure.py --measure-world" times the parts of the game that grow with
+the world, for whichever world ADVENTURE_WORLD points at.
+"""
+GENERATED_ITEM_CHANCE = 0.05
+GENERATED_ROOMS_PER_NPC = 100
+HOTEL_FLOOR_ROOMS = 15
+TEMPLATE_ROOM_TTL = 300
+
+def ordinal(number):
+    if number % 100 in (11, 12, 13):
+        return '%dth' % (number)
+    return '%d%s' % (number, {1: 'st', 2: 'nd', 3: 'rd'}.get(number % 10, 'th'))
+
+def templateRoomDict(template, name, desc, exits, exitsOnly=False):
+    """Returns a room made by template, with an item on the ground every so
+    often; which rooms get one depends only on the seed and the room. With
+    exitsOnly it returns just the exits, which is all a route search needs."""
+    if exitsOnly:
+        return exits
+    rng = random.Random('%s:%s' % (template['seed'], name))
+    ground = []
+    if rng.random() < GENERATED_ITEM_CHANCE:
+        ground.append(rng.choice(template['items']))
+    room = {DESC: desc}
+    room.update(exits)
+    room.update({NPC: [], OTHERPLAYERS: [], GROUND: ground})
+    return room
+
+def hotelFloor(template, floor, exitsOnly=False):
+    """Returns {name: room} for a floor of the hotel"""
+    rooms = {}
+    first, last = template['floors']
+    elevator = 'Elevator %d' % (floor)
+    exits = {WEST: 'Laundry Room %d' % (floor), EAST: 'Ice Machine %d' % (floor), SOUTH: 'Rooms %d01-%d02' % (floor, floor), DOWN: 'Elevator %d' % (floor - 1)}
+    if floor < last:
+        exits[UP] = 'Elevator %d' % (floor + 1)
+    rooms[elevator] = templateRoomDict(template, elevator, 'Elevator on the %s floor.' % (ordinal(floor)), exits, exitsOnly)
+    rooms['Ice Machine %d' % (floor)] = templateRoomDict(template, 'Ice Machine %d' % (floor), 'Ice Machine room on the %s floor.' % (ordinal(floor)), {WEST: elevator}, exitsOnly)
+    rooms['Laundry Room %d' % (floor)] = templateRoomDict(template, 'Laundry Room %d' % (floor), 'Laundry room on the %s floor.' % (ordinal(floor)), {EAST: elevator}, exitsOnly)
+    for pair in range(4):
+        west = floor * 100 + pair * 2 + 1
+        corridor = 'Rooms %d-%d' % (west, west + 1)
+        exits = {WEST: 'Room %d' % (west), EAST: 'Room %d' % (west + 1)}
+        exits[NORTH] = elevator if pair == 0 else 'Rooms %d-%d' % (west - 2, west - 1)
+        if pair < 3:
+            exits[SOUTH] = 'Rooms %d-%d' % (west + 2, west + 3)
+        rooms[corridor] = templateRoomDict(template, corridor, 'A corridor on the %s floor.' % (ordinal(floor)), exits, exitsOnly)
+        rooms['Room %d' % (west)] = templateRoomDict(template, 'Room %d' % (west), 'Room %d.' % (west), {EAST: corridor}, exitsOnly)
+        rooms['Room %d' % (west + 1)] = templateRoomDict(template, 'Room %d' % (west + 1), 'Room %d.' % (west + 1), {WEST: corridor}, exitsOnly)
+    return rooms
+
+def sewerTunnel(template, x, y, exitsOnly=False):
+    """Returns the name and room of the sewer tunnel at x, y, or None if there isn't one"""
+    width = template['width']
+    tunnels = template['tunnels']
+    index = y * width + x
+    if x >= width or index >= tunnels:
+        return None
+    exits = {}
+    if x > 0:
+        exits[WEST] = 'Sewer Tunnel %d-%d' % (x - 1, y)
+    if x < width - 1 and index + 1 < tunnels:
+        exits[EAST] = 'Sewer Tunnel %d-%d' % (x + 1, y)
+    if y > 0:
+        exits[NORTH] = 'Sewer Tunnel %d-%d' % (x, y - 1)
+    if index + width < tunnels:
+        exits[SOUTH] = 'Sewer Tunnel %d-%d' % (x, y + 1)
+    if index == 0:
+        exits[WEST] = template['attach']
+    name = 'Sewer Tunnel %d-%d' % (x, y)
+    return name, templateRoomDict(template, name, 'A dark, dripping sewer tunnel. Scratched on the wall is "%d-%d".' % (x, y), exits, exitsOnly)
+
+def templateRoom(templates, name, exitsOnly=False):
+    """Returns the room called name as one of templates makes it, or None if
+    none of them do. With exitsOnly the room is just its exits."""
+    for template in templates:
+        if template['template'] == 'hotel':
+            match = re.match(r'(?:Elevator|Ice Machine|Laundry Room) (\d+)$', name)
+            if match != None:
+                floor = int(match.group(1))
+            else:
+                match = re.match(r'Rooms? (\d+)(?:-\d+)?$', name)
+                if match == None:
+                    continue
+                floor = int(match.group(1)) // 100
+            if template['floors'][0] <= floor <= template['floors'][1]:
+                room = hotelFloor(template, floor, exitsOnly).get(name)
+                if room != None:
+                    return room
+        elif template['template'] == 'sewer':
+            match = re.match(r'Sewer Tunnel (\d+)-(\d+)$', name)
+            if match != None:
+                tunnel = sewerTunnel(template, int(match.group(1)), int(match.group(2)), exitsOnly)
+                if tunnel != None:
+                    return tunnel[1]
+    return None
+
+def generateWorld(roomCount, seed=0, lazy=False):
+    """Returns a world of roomCount rooms, the town included, with templates
+    in place of the hotel floors and sewer tunnels if lazy is set"""
+    with open(TOWN_WORLD_FILE, 'rb') as f:
+        world = json.loads(f.read().decode('utf-8'))
+    rooms = world['worldRooms']
+    takeable = [item for item in world['worldItems'] if world['worldItems'][item].get(TAKEABLE, True) and world['worldItems'][item][TYPE] == 'inventory']
+    townRooms = len(rooms)
+
+    # hotel floors on top of the three there are already, then a grid of
+    # sewer tunnels joined to the east of the Town Square Sewer
+    floors = max(0, roomCount - townRooms) // 2 // HOTEL_FLOOR_ROOMS
+    tunnels = max(0, roomCount - townRooms - floors * HOTEL_FLOOR_ROOMS)
+    hotel = {'template': 'hotel', 'floors': [4, 3 + floors], 'seed': seed, 'items': takeable}
+    sewer = {'template': 'sewer', 'tunnels': tunnels, 'width': max(1, int(tunnels ** 0.5)), 'attach': 'Town Square Sewer', 'seed': seed, 'items': takeable}
+    templates = []
+    if floors > 0:
+        rooms['Elevator 3'][UP] = 'Elevator 4'
+        templates.append(hotel)
+    if tunnels > 0:
+        rooms['Town Square Sewer'][EAST] = 'Sewer Tunnel 0-0'
+        templates.append(sewer)
+
+    if lazy:
+        world['roomTemplates'] = templates
+    else:
+        for floor in range(4, 4 + floors):
+            rooms.update(hotelFloor(hotel, floor))
+        for index in range(tunnels):
+            name, room = sewerTunnel(sewer, index % sewer['width'], index // sewer['width'])
+            rooms[name] = room
+
+    # more NPCs, copied from the town's
+    townNPCs = list(world['NPCs'])
+    for number in range(roomCount // GENERATED_ROOMS_PER_NPC):
+        template = world['NPCs'][townNPCs[number % len(townNPCs)]]
+        name = '%s %d' % (townNPCs[number % len(townNPCs)], number + 1)
+        world['NPCs'][name] = copy.deepcopy(template)
+        world['NPCs'][name][DESCWORDS] = [name.lower().replace(' ', '')]
+
+    return world
+
+class TemplatedRooms(dict):
+    """worldRooms for a world with room templates, which makes a room from
+    its template the first time it is asked for.
+
+    Going through it only sees the rooms made so far, which is all that
+    anything that goes through every room needs: a room not made yet is
+    just as its template makes it, so worldDelta() has nothing to save for
+    it, and templates never put NPCs or players in a room, so an NPC or
+    player is always in a made room. Such a room is never thrown away, as
+    its NPCs or players differ from its template's. placeRandoms() only
+    places things in rooms that have been made, and the route table only
+    knows the rooms in world.json (see findRoute())."""
+
+    def __missing__(self, name):
+        room = templateRoom(roomTemplates, name)
+        if room == None:
+            raise KeyError(name)
+        dict.__setitem__(self, name, room)
+        baseRooms[name] = {}
+        for key in MUTABLE_ROOM_KEYS:
+            if key in room:
+                baseRooms[name][key] = list(room[key])
+        templateRoomsMade[name] = time.time()
+        indexItemLists(name)
+        return room
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or templateRoom(roomTemplates, name, True) != None
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+templateRoomsMade = {}
+lastTemplateEviction = time.time()
+
+def evictTemplateRooms():
+    """Throws away the rooms made from templates that nobody is using and
+    that are just as their template made them; called by the game clock"""
+    global lastTemplateEviction
+
+    if len(templateRoomsMade) == 0 or time.time() - lastTemplateEviction < EVICT_INTERVAL:
+        return
+    if stateLock.acquire(blocking=False) == False:
+        return # try again next second
+    try:
+        lastTemplateEviction = time.time()
+        occupied = set(playerRooms.values())
+        for room in list(templateRoomsMade):
+            if lastTemplateEviction - templateRoomsMade[room] < TEMPLATE_ROOM_TTL:
+                continue
+            if room == location or room in occupied or len(worldRooms[room][OTHERPLAYERS]) > 0:
+                continue
+            changed = False
+            for key in MUTABLE_ROOM_KEYS:
+                if worldRooms[room].get(key) != baseRooms[room].get(key):
+                    changed = True
+            if changed:
+                continue # it has to stay, or the change would be lost
+            dict.__delitem__(worldRooms, room)
+            del baseRooms[room]
+            del templateRoomsMade[room]
+            roomVersions.pop(room, None)
+            roomSectionsCache.pop(room, None)
+            roomTextCache.pop(room, None)
+            roomExitsCache.pop((room, True), None)
+            roomExitsCache.pop((room, False), None)
+    finally:
+        stateLock.release()
+
+world = loadWorld()
+worldRooms = world['worldRooms']
+roomTemplates = world.get('roomTemplates', [])
+if len(roomTemplates) > 0:
+    worldRooms = TemplatedRooms(worldRooms)
+worldItems = world['worldItems']
 
 playerStats = {
     'Player Name': USERNAME,
@@ -861,113 +906,277 @@ playerStats = {
 
 currentPlayers = {}
 
-NPCs = {
-    'Dave': {
-        'Inventory': ['Meat Pie', 'Donut', 'Sword'],
-        'Health': 100,
-        'XP': 2,
-        'HP': 1,
-        'Money': 40,
-        DESCWORDS: ['dave']},
-    'Steve': {
-        'Inventory': ['Meat Pie', 'Meat Pie', 'Meat Pie', 'Meat Pie', 'Donut', 'Donut', 'Donut', 'Donut', 'Donut', 'Sword'],
-        'Health': 100,
-        'XP': 2,
-        'HP': 2,
-        'Money': 100,
-        DESCWORDS: ['steve']},
-    'Fred': {
-        'Inventory': ['Sword'],
-        'Health': 100,
-        'XP': 3,
-        'HP': 3,
-        'Money': 100,
-        DESCWORDS: ['fred']},
-    'Ghost of Christmas Present': {
-        'Inventory': ['Meat Pie', 'Meat Pie', 'Meat Pie', 'Meat Pie', 'Meat Pie', 'Meat Pie', 'Meat Pie', 'Meat Pie', 'Meat Pie', 'Meat Pie', 'War Axe'],
-        'Health': 150,
-        'XP': 5,
-        'HP': 10,
-        'Money': 1000,    
-        DESCWORDS: ['ghost', 'gocp']},
-    'Sam': {
-        'Inventory': ['Sword'],
-        'Health': 100,
-        'XP': 20,
-        'HP': 10,
-        'Money': 40,
-        DESCWORDS: ['sam']},
-    'Dean': {
-        'Inventory': ['Meat Pie', 'Donut', 'Sword'],
-        'Health': 100,
-        'XP': 20,
-        'HP': 10,
-        'Money': 40,
-        DESCWORDS: ['dean']},
-    'Castiel': {
-        'Inventory': ['Sword', 'Great Sword', 'War Axe'],
-        'Health': 300,
-        'XP': 200,
-        'HP': 30,
-        'Money': 0,
-        DESCWORDS: ['castiel']},
-    'Gabriel': {
-        'Inventory': ['Sword', 'Great Sword', 'War Axe'],
-        'Health': 300,
-        'XP': 200,
-        'HP': 30,
-        'Money': 0,
-        DESCWORDS: ['gabriel']},
-    'Zachariah': {
-        'Inventory': ['Sword', 'Great Sword', 'War Axe'],
-        'Health': 300,
-        'XP': 200,
-        'HP': 50,
-        'Money': 100,
-        DESCWORDS: ['zachariah']},
-    'Anna': {
-        'Inventory': ['Sword', 'Great Sword', 'War Axe'],
-        'Health': 300,
-        'XP': 300,
-        'HP': 30,
-        'Money': 100,
-        DESCWORDS: ['anna']},
-    'Michael': {
-        'Inventory': ['Sword', 'Great Sword', 'War Axe'],
-        'Health': 500,
-        'XP': 200,
-        'HP': 50,
-        'Money': 0,
-        DESCWORDS: ['michael']},
-    'Lucifer': {
-        'Inventory': ['Sword', 'Great Sword', 'War Axe'],
-        'Health': 500,
-        'XP': 200,
-        'HP': 50,
-        'Money': 0,
-        DESCWORDS: ['lucifer']},
-    'Bobby': {
-        'Inventory': ['Meat Pie', 'Donut', 'Sword'],
-        'Health': 70,
-        'XP': 20,
-        'HP': 10,
-        'Money': 400,
-        DESCWORDS: ['bobby']},
-    'Ruby': {
-        'Inventory': ['Great Sword'],
-        'Health': 200,
-        'XP': 200,
-        'HP': 20,
-        'Money': 0,
-        DESCWORDS: ['ruby']},
-    'Meg': {
-        'Inventory': ['Great Sword'],
-        'Health': 200,
-        'XP': 200,
-        'HP': 20,
-        'Money': 100,
-        DESCWORDS: ['meg']},
-}
+NPCs = world['NPCs']
+
+"""
+Every room and NPC has an integer id, its place in the world, which is the
+id of its record. The route table and the NPC simulation work in ids, and
+these tables turn names into ids and back again.
+"""
+roomNames = list(worldRooms)
+roomIds = dict((name, roomId) for roomId, name in enumerate(roomNames))
+npcNames = list(NPCs)
+npcIds = dict((name, npcId) for npcId, name in enumerate(npcNames))
+npcColumns = world['npcColumns']
+
+"""
+Items are found by their description words. descWordItems goes from each
+word to the items it describes, and every list of items the player can
+match against (their inventory, and the ground and shop of each room) is an
+ItemList, which keeps count of the items and words in it as they come and
+go. Finding "sword" on the ground is then a couple of dict lookups rather
+than a look at every item there.
+"""
+descWordItems = {}
+for item in worldItems:
+    for word in worldItems[item][DESCWORDS]:
+        descWordItems.setdefault(word, []).append(item)
+itemDescWords = dict((item, tuple(worldItems[item][DESCWORDS])) for item in worldItems)
+
+"""
+Only items with damage, body or sheild matter in a fight. combatItems holds
+(damage, body, sheild) for each of them, and every ItemList keeps the best
+weapon in it and the defence it gives up to date from those as items come
+and go, so a hit never has to look through an inventory.
+"""
+combatItems = {}
+for item in worldItems:
+    stats = (worldItems[item].get(DAMAGE, 0), worldItems[item].get(BODY, 0), worldItems[item].get(SHEILD, 0))
+    if stats != (0, 0, 0):
+        combatItems[item] = stats
+
+def hitDamage(attacker, defender):
+    """Returns the damage one hit from the ItemList attacker does through the defence of the ItemList defender"""
+    return max(0, random.randint(0, attacker.maxDamage) - defender.defence)
+
+class WordTrie(object):
+    """A prefix tree of words for tab completion. Each node is a dict of
+    {letter: node}, and a word ending at a node is kept under None."""
+    __slots__ = ('root',)
+
+    def __init__(self, words=()):
+        self.root = {}
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        node = self.root
+        for letter in word:
+            node = node.setdefault(letter, {})
+        node[None] = word
+
+    def discard(self, word):
+        path = []
+        node = self.root
+        for letter in word:
+            if letter not in node:
+                return
+            path.append((node, letter))
+            node = node[letter]
+        node.pop(None, None)
+        for parent, letter in reversed(path):
+            if len(parent[letter]) > 0:
+                break
+            del parent[letter] # prune the branch the word no longer needs
+
+    def complete(self, prefix):
+        """Returns every word that starts with prefix"""
+        node = self.root
+        for letter in prefix:
+            node = node.get(letter)
+            if node == None:
+                return []
+        words = []
+        nodes = [node]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            for letter in node:
+                if letter == None:
+                    words.append(node[None])
+                else:
+                    nodes.append(node[letter])
+        return words
+
+    def prefixOf(self, text):
+        """Returns True if some word is text or is followed by a space at the start of text"""
+        node = self.root
+        for index in range(len(text) + 1):
+            if None in node and (index == len(text) or text[index] == ' '):
+                return True
+            if index == len(text) or text[index] not in node:
+                return False
+            node = node[text[index]]
+
+class ItemList(list):
+    """A list of item names that keeps counts of the items and of the
+    description words in it up to date as it changes, along with a
+    WordTrie of those words for tab completion and its combat profile:
+    bestWeapon (None if it has none), maxDamage and defence, which is the
+    best body plus the best sheild in it"""
+
+    room = None # the room whose ground or shop this is, touched whenever it changes
+
+    def __init__(self, items=()):
+        list.__init__(self, items)
+        self.counts = {}
+        self.words = {}
+        self.trie = WordTrie()
+        self.combat = {}
+        self.profile()
+        for item in self:
+            self.added(item)
+
+    def profile(self):
+        """Works out the combat profile again from the combat items in the list"""
+        self.bestWeapon = None
+        self.maxDamage = 0
+        body = 0
+        sheild = 0
+        for item in self.combat:
+            damage, itemBody, itemSheild = combatItems[item]
+            if damage > self.maxDamage:
+                self.bestWeapon = item
+                self.maxDamage = damage
+            body = max(body, itemBody)
+            sheild = max(sheild, itemSheild)
+        self.defence = body + sheild
+
+    def added(self, item):
+        if self.room != None:
+            touchRoom(self.room)
+        if item in self.counts:
+            self.counts[item] += 1
+            return
+        self.counts[item] = 1
+        for word in itemDescWords.get(item, ()):
+            if word in self.words:
+                self.words[word] += 1
+            else:
+                self.words[word] = 1
+                self.trie.add(word)
+        if item in combatItems:
+            self.combat[item] = True
+            self.profile() # only ever looks at one of each kind of weapon or armour
+
+    def removed(self, item):
+        if self.room != None:
+            touchRoom(self.room)
+        if self.counts[item] > 1:
+            self.counts[item] -= 1
+            return
+        del self.counts[item]
+        for word in itemDescWords.get(item, ()):
+            if self.words[word] > 1:
+                self.words[word] -= 1
+            else:
+                del self.words[word]
+                self.trie.discard(word)
+        if item in self.combat:
+            del self.combat[item]
+            self.profile()
+
+    def append(self, item):
+        list.append(self, item)
+        self.added(item)
+
+    def insert(self, index, item):
+        list.insert(self, index, item)
+        self.added(item)
+
+    def extend(self, items):
+        items = list(items)
+        list.extend(self, items)
+        for item in items:
+            self.added(item)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def remove(self, item):
+        list.remove(self, item)
+        self.removed(item)
+
+    def pop(self, index=-1):
+        item = list.pop(self, index)
+        self.removed(item)
+        return item
+
+    def clear(self):
+        list.clear(self)
+        self.counts = {}
+        self.words = {}
+        self.trie = WordTrie()
+        self.combat = {}
+        self.profile()
+        if self.room != None:
+            touchRoom(self.room)
+
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self.__init__(list(self)) # rare enough to just count again
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self.__init__(list(self))
+
+    def __imul__(self, times):
+        list.__imul__(self, times)
+        self.__init__(list(self))
+        return self
+
+    def __reduce__(self):
+        return (list, (list(self),)) # saves and frames hold plain lists
+
+def itemCounts(itemList):
+    """Returns {item: count} for itemList, which need not be an ItemList"""
+    if isinstance(itemList, ItemList):
+        return itemList.counts
+    return ItemList(itemList).counts
+
+def indexItemLists(room):
+    """Makes the ground and shop of room ItemLists"""
+    for key in (GROUND, SHOP):
+        if key in worldRooms[room] and isinstance(worldRooms[room][key], ItemList) == False:
+            worldRooms[room][key] = ItemList(worldRooms[room][key])
+            worldRooms[room][key].room = room
+    touchRoom(room)
+
+"""
+Each room has a version, bumped by touchRoom() whenever something shown
+when the room is displayed changes: its ground, its NPCs or their health,
+or the players in it. displayLocation() only redraws those parts of a room
+when its version has moved on. Touched rooms are also noted in
+deltaRoomsTouched, so worldDelta() only looks at them again.
+"""
+roomVersions = {}
+deltaRoomsTouched = set()
+
+def touchRoom(room):
+    roomVersions[room] = roomVersions.get(room, 0) + 1
+    deltaRoomsTouched.add(room)
+
+for room in worldRooms:
+    indexItemLists(room)
+
+"""
+Saves only store how the world differs from how world.json defines it, so
+this keeps a copy of the parts of each room that can change, and of the
+NPCs, before the game touches them.
+"""
+MUTABLE_ROOM_KEYS = (GROUND, NPC, SHOP)
+baseRooms = {}
+for room in worldRooms:
+    baseRooms[room] = {}
+    for key in MUTABLE_ROOM_KEYS:
+        if key in worldRooms[room]:
+            baseRooms[room][key] = list(worldRooms[room][key])
+baseNPCs = dict((npc, copy.deepcopy(dict(NPCs[npc]))) for npc in NPCs)
+baseNPCColumns = {}
+for column in ('health', 'xp', 'hp'):
+    baseNPCColumns[column] = copy.copy(getattr(npcColumns, column))
+deltaRoomsTouched.clear() # every room is as it was defined
+roomDeltas = {}
 
 """
 These variables track where the player is and what is in their inventory.
@@ -976,7 +1185,7 @@ and the value in the inventory list will always be a key in the worldItems
 variable.
 """
 location = playerStats['Location'] # start in default player location denoted in the playerStats list
-inventory = ['README Note', 'Sword', 'Donut'] # start with blank inventory
+inventory = ItemList(['README Note', 'Sword', 'Donut']) # start with blank inventory
 showFullExits = True
 godMode = False
 
@@ -1044,107 +1253,922 @@ def placeRandoms():
         if len(randNpcs) > 0:
             npc = random.choice(randNpcs)
             randNpcs.remove(npc)
-            worldRooms[room][NPC].append(npc)
+            placeNPC(npc, room)
     print()
 
 
-def updatePlayers():
-    """Add player to currentPlayers dictionary"""
+def changedNPCColumns():
+    """Returns the ids of the NPCs whose health, XP or HP is not what it was defined as"""
+    if numpy != None:
+        changed = numpy.zeros(len(npcColumns.health), dtype=bool)
+        for column in baseNPCColumns:
+            changed |= getattr(npcColumns, column) != baseNPCColumns[column]
+        return [int(npcId) for npcId in numpy.flatnonzero(changed)]
+    ids = []
+    for column in baseNPCColumns:
+        if getattr(npcColumns, column) != baseNPCColumns[column]:
+            ids.extend([npcId for npcId, (value, base) in enumerate(zip(getattr(npcColumns, column), baseNPCColumns[column])) if value != base])
+    return ids
+
+def worldDelta():
+    """Returns the changes made to the world since it was defined: the
+    changed ground, NPCs and shop of each room and the changed NPC stats.
+    The changes to each room are kept in roomDeltas and only worked out
+    again for the rooms touched since the last call, and only the NPCs
+    whose records were set or whose columns moved are looked at, so this
+    costs what has changed rather than the size of the world."""
+    for room in deltaRoomsTouched:
+        if room not in baseRooms:
+            roomDeltas.pop(room, None) # a room from a template that was thrown away
+            continue
+        changes = {}
+        for key in MUTABLE_ROOM_KEYS:
+            if worldRooms[room].get(key) != baseRooms[room].get(key):
+                changes[key] = list(worldRooms[room].get(key, []))
+        if len(changes) > 0:
+            roomDeltas[room] = changes
+        else:
+            roomDeltas.pop(room, None)
+    deltaRoomsTouched.clear()
+    rooms = dict(roomDeltas)
+
+    npcs = {}
+    for npcId in sorted(npcColumns.written.union(changedNPCColumns())):
+        npc = npcNames[npcId]
+        changes = {}
+        for key in NPCs[npc]:
+            if NPCs[npc][key] != baseNPCs[npc].get(key):
+                changes[key] = copy.deepcopy(NPCs[npc][key])
+        if len(changes) > 0:
+            npcs[npc] = changes
+
+    return {'rooms': rooms, 'npcs': npcs}
+
+def applyWorldDelta(delta):
+    """Puts the world back to how it was defined and then applies delta"""
+    for room in list(worldRooms):
+        for key in MUTABLE_ROOM_KEYS:
+            if key in baseRooms[room]:
+                worldRooms[room][key] = list(baseRooms[room][key])
+        indexItemLists(room)
+    for room in delta['rooms']:
+        if room in worldRooms: # rooms from templates are made here if need be
+            worldRooms[room].update(delta['rooms'][room])
+            indexItemLists(room)
+
+    for npc in NPCs:
+        for key in list(NPCs[npc]):
+            if key not in baseNPCs[npc]:
+                del NPCs[npc][key]
+        NPCs[npc].update(copy.deepcopy(baseNPCs[npc]))
+        NPCs[npc].update(delta['npcs'].get(npc, {}))
+    npcColumns.written.clear()
+    npcColumns.written.update([npcIds[npc] for npc in delta['npcs'] if npc in npcIds])
+    syncNPCRooms()
+
+"""
+A player's save is a single <user>.save file:
+
+    SAVE_MAGIC and the version
+    SAVE_HEADER: a crc32 of everything after it, the length of the body, when
+    it was saved, the player's money and the lengths of the two strings that
+    follow it
+    the player's name and location
+    the body, compressed with zlib, which holds the length of the section
+    table, the section table, a pickle of {section name: (offset, length)}
+    with offsets counted from the end of the table, and then each section
+    pickled on its own
+
+The header is enough to list saves without touching the body, and the crc is
+checked before anything is decompressed or unpickled, so a damaged file is
+turned away rather than loaded. Version 1 saves, which have the uncompressed
+table straight after the version and no summary, can still be loaded.
+
+It is written to a temporary file, synced once and renamed into place, so a
+crash leaves either the old save or the new one, never half of each.
+"""
+SAVE_MAGIC = b'ADVSAVE\0'
+SAVE_VERSION = 2
+SAVE_PREFIX = struct.Struct('>8sH')
+SAVE_HEADER = struct.Struct('>IIdqHH')
+SAVE_TABLE_LENGTH = struct.Struct('>I')
+
+def saveFile(name):
+    return '%s%s.save' % (SAVES_FOLDER, name)
+
+def writeSave(path, sections):
+    """Atomically replaces the save at path with the given {name: object}
+    sections, which must include playerStats for the header"""
+    blobs = {}
+    for name in sections:
+        blobs[name] = pickle.dumps(sections[name])
+
+    # offsets count from the end of the table
+    table = {}
+    offset = 0
+    for name in blobs:
+        table[name] = (offset, len(blobs[name]))
+        offset += len(blobs[name])
+    tableData = pickle.dumps(table)
+    body = zlib.compress(SAVE_TABLE_LENGTH.pack(len(tableData)) + tableData + b''.join(blobs.values()))
+
+    stats = sections['playerStats']
+    player = str(stats['Player Name']).encode('utf-8')
+    place = str(stats['Location']).encode('utf-8')
+    summary = SAVE_HEADER.pack(0, len(body), time.time(), stats['Money'], len(player), len(place))[4:] + player + place
+    crc = zlib.crc32(body, zlib.crc32(summary))
+
+    file_temp = '%s.%s.tmp' % (path, NODENUMB)
+    with open(file_temp, 'wb') as f:
+        f.write(SAVE_PREFIX.pack(SAVE_MAGIC, SAVE_VERSION))
+        f.write(struct.pack('>I', crc))
+        f.write(summary)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(file_temp, path)
+
+def openSave(f, path):
+    """Reads the start of an open save and returns its version"""
+    magic, version = SAVE_PREFIX.unpack(f.read(SAVE_PREFIX.size))
+    if magic != SAVE_MAGIC or version not in (1, 2):
+        raise ValueError('%s is not a save this version can load' % (path))
+    return version
+
+def readSaveHeader(f, path):
+    """Returns the header of a version 2 save, with f left at the start of its body"""
+    data = f.read(SAVE_HEADER.size)
+    crc, bodyLength, saved, money, playerLength, placeLength = SAVE_HEADER.unpack(data)
+    strings = f.read(playerLength + placeLength)
+    if len(strings) != playerLength + placeLength:
+        raise ValueError('%s is cut short' % (path))
+    return {'Version': 2, 'Player Name': strings[:playerLength].decode('utf-8', 'replace'),
+            'Location': strings[playerLength:].decode('utf-8', 'replace'), 'Money': money, 'Saved': saved,
+            'crc': crc, 'Header crc': zlib.crc32(strings, zlib.crc32(data[4:])), 'Body Length': bodyLength}
+
+def saveSummary(path, check=False):
+    """Returns the header of the save at path without reading its body, or,
+    if check is set, having checked that the body matches its crc"""
+    with open(path, 'rb') as f:
+        if openSave(f, path) == 1:
+            # version 1 saves have no header, so the stats have to be read
+            stats = readSave(path, ['playerStats'])['playerStats']
+            return {'Version': 1, 'Player Name': stats['Player Name'], 'Location': stats['Location'],
+                    'Money': stats['Money'], 'Saved': os.path.getmtime(path)}
+        header = readSaveHeader(f, path)
+        if check == True:
+            readSaveBody(f, path, header)
+        return header
+
+def readSaveBody(f, path, header):
+    """Reads the body of a version 2 save and returns it decompressed, once it has matched its crc"""
+    body = f.read(header['Body Length'])
+    if len(body) != header['Body Length']:
+        raise ValueError('%s is cut short' % (path))
+    if zlib.crc32(body, header['Header crc']) != header['crc']:
+        raise ValueError('%s is damaged' % (path))
+    return zlib.decompress(body)
+
+def readSave(path, names):
+    """Returns {name: object} for just the named sections of the save at path"""
+    sections = {}
+    with open(path, 'rb') as f:
+        if openSave(f, path) == 1:
+            body = f.read() # the table length, the table and the sections, uncompressed
+        else:
+            body = readSaveBody(f, path, readSaveHeader(f, path))
+
+    tableLength, = SAVE_TABLE_LENGTH.unpack_from(body)
+    start = SAVE_TABLE_LENGTH.size + tableLength
+    table = pickle.loads(body[SAVE_TABLE_LENGTH.size:start])
+    for name in names:
+        if name in table:
+            offset, length = table[name]
+            sections[name] = pickle.loads(body[start + offset:start + offset + length])
+    return sections
+
+def listSaves(check=False):
+    """Returns [(file name, header)] for every save in SAVES_FOLDER, newest
+    first, and [(file name, reason)] for any that could not be read"""
+    saves = []
+    broken = []
+    for entry in os.scandir(SAVES_FOLDER):
+        if entry.name.endswith('.save') or entry.name.endswith('.autosave'):
+            try:
+                saves.append((entry.name, saveSummary(entry.path, check)))
+            except (OSError, ValueError, EOFError, KeyError, struct.error, zlib.error, pickle.UnpicklingError) as e:
+                broken.append((entry.name, str(e)))
+    saves.sort(key=lambda save: save[1]['Saved'], reverse=True)
+    return saves, broken
+
+"""
+Autosave runs off the game clock. Every AUTOSAVE_INTERVAL game seconds the
+clock thread copies out what a save needs while holding stateLock, which
+every command and every incoming event also hold while they change things,
+so the copy never catches one half done. worldDelta() only looks at what
+changed since the last copy, so the lock is held for as long as that takes
+rather than for a walk over the whole world. The copy is then written on
+its own thread, so neither the clock nor the prompt ever wait on the disk.
+
+Autosaves go to <user>.autosave so they never overwrite a save the player
+made on purpose; "load autosave" loads one. A copy that is the same as the
+last one written is not written again, and once AUTOSAVE_BUDGET bytes have
+been written in a session autosave stops. Set either to 0 to turn it off.
+"""
+AUTOSAVE_INTERVAL = 120
+AUTOSAVE_BUDGET = 4*1024*1024
+stateLock = threading.RLock()
+autosaveClock = 0
+autosaveBytes = 0
+autosaveWriter = None
+lastAutosave = None
+
+def autosaveFile(name):
+    return '%s%s.autosave' % (SAVES_FOLDER, name)
+
+def saveSnapshot():
+    """Returns the sections of a save, copied so that they share nothing with the running game"""
+    return {'playerStats': copy.deepcopy(playerStats), 'inventory': list(inventory), 'world': worldDelta()}
+
+def writeAutosave(snapshot):
+    global autosaveBytes
+    path = autosaveFile(USERNAME)
+    try:
+        writeSave(path, snapshot)
+        autosaveBytes += os.path.getsize(path)
+    except OSError:
+        pass # the next autosave will try again
+
+def autosave():
+    """Called by the game clock once every game second"""
+    global autosaveClock
+    global autosaveWriter
+    global lastAutosave
+
+    if AUTOSAVE_INTERVAL <= 0 or autosaveBytes >= AUTOSAVE_BUDGET:
+        return
+    autosaveClock += 1
+    if autosaveClock < AUTOSAVE_INTERVAL:
+        return
+    if autosaveWriter != None and autosaveWriter.is_alive():
+        return # the last one is still being written
+
+    # a command waiting on input() keeps hold of the lock, so rather than
+    # stall the clock until it finishes just try again next second
+    if stateLock.acquire(blocking=False) == False:
+        return
+    try:
+        snapshot = saveSnapshot()
+    finally:
+        stateLock.release()
+
+    autosaveClock = 0
+    if snapshot == lastAutosave:
+        return
+    lastAutosave = snapshot
+    autosaveWriter = threading.Thread(target=writeAutosave, args=(snapshot,))
+    autosaveWriter.daemon = True
+    autosaveWriter.start()
+
+def playerRecordFile(name):
+    """Returns the path of the record file for the player called name"""
+    return '%s%s.player' % (PLAYERS_FOLDER, name)
+
+def playerAliveFile(name):
+    """Returns the path of the heartbeat file for the player called name.
+    Its mtime is the heartbeat, which is bumped with utime() so that it never
+    looks like a change to the records themselves."""
+    return '%s%s.alive' % (PLAYERS_FOLDER, name)
+
+def writePlayerRecord(name, record):
+    """Replaces one player's record file.
+
+    The record is written to a temporary file first and then renamed over
+    the old one, so other nodes never read half a record."""
+    file_record = playerRecordFile(name)
+    file_temp = '%s.%s.tmp' % (file_record, NODENUMB)
+    with open(file_temp, 'wb') as f:
+        pickle.dump(record, f)
+    os.replace(file_temp, file_record)
+
+def readPlayerRecord(path):
+    """Loads a single player record, or returns None if it has just been removed"""
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+
+# Change detection for the other players' records. Every record write is a
+# rename into PLAYERS_FOLDER, which moves the folder's mtime, so an idle tick
+# only has to stat() the folder. Each record is then only reloaded when its
+# own (inode, mtime, size) stamp moved.
+playersFolderStamp = None
+playerRecordStamps = {}
+otherPlayerRecords = {}
+lastPlayerRecord = None
+
+lastHeartbeat = 0
+lastEviction = 0
+
+def heartbeat():
+    """Refreshes our heartbeat every HEARTBEAT_INTERVAL seconds"""
+    global lastHeartbeat
+    global lastPlayerRecord
+    global eventOffset
+
+    now = time.time()
+    if now - lastHeartbeat < HEARTBEAT_INTERVAL:
+        return
+    lastHeartbeat = now
+    try:
+        os.utime(playerAliveFile(playerStats['Player Name']))
+    except FileNotFoundError:
+        # First beat, or another node evicted us while we were stalled, which
+        # also removed our event log; any sent to since is read from the top,
+        # and readEvents() waits for the heartbeat so the offset goes first
+        eventOffset = 0
+        open(playerAliveFile(playerStats['Player Name']), 'a').close()
+        lastPlayerRecord = None
+        markPlayerDirty()
+
+def evictStalePlayers():
+    """Removes, in one pass, every player whose heartbeat is older than PLAYER_TTL"""
+    global lastEviction
+
+    now = time.time()
+    if now - lastEviction < EVICT_INTERVAL:
+        return
+    lastEviction = now
+
+    beats = {}
+    records = []
+    for entry in os.scandir(PLAYERS_FOLDER):
+        name, ext = os.path.splitext(entry.name)
+        try:
+            if ext == '.alive':
+                beats[name] = entry.stat().st_mtime
+            elif ext == '.player':
+                records.append((name, entry.stat().st_mtime))
+        except FileNotFoundError:
+            pass
+
+    for name, written in records:
+        if name == playerStats['Player Name']:
+            continue
+        if now - beats.get(name, written) > PLAYER_TTL:
+            for path in (playerRecordFile(name), playerAliveFile(name), eventLogFile(name)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    # and the event logs of players with no record at all, whose node died
+    # before it could write one or remove its log
+    players = set(beats) | set([name for name, written in records])
+    for entry in os.scandir(EVENTS_FOLDER):
+        name, ext = os.path.splitext(entry.name)
+        if ext != '.events' or name in players or name == playerStats['Player Name']:
+            continue
+        try:
+            if now - entry.stat().st_mtime > PLAYER_TTL:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+# Write-behind for our own record. Commands only mark it dirty and the tick
+# writes it out at most once every FLUSH_INTERVAL_MS, however fast they come.
+# Anything other nodes must see straight away (PvP, dying) forces a flush.
+FLUSH_INTERVAL_MS = 1000
+playerDirty = True
+lastPlayerFlush = 0
+
+def refreshPlayerRecords():
+    """Reloads the records of other players that changed since the last call.
+    Returns the set of players whose record was added, changed or removed."""
+    global playersFolderStamp
+
+    st = os.stat(PLAYERS_FOLDER)
+    stamp = (st.st_ino, st.st_mtime_ns)
+    # A rename landing in the same timestamp granule as our last scan would
+    # not move the mtime, so keep rescanning until the mtime is safely old.
+    if stamp == playersFolderStamp and time.time() - st.st_mtime > 1:
+        return set()
+    playersFolderStamp = stamp
+
+    changed = set()
+    seen = set()
+    for entry in os.scandir(PLAYERS_FOLDER):
+        if not entry.name.endswith('.player'):
+            continue
+        name = entry.name[:-len('.player')]
+        if name == playerStats['Player Name']:
+            continue # our own record is always current in memory
+        seen.add(name)
+        est = entry.stat()
+        recordStamp = (est.st_ino, est.st_mtime_ns, est.st_size)
+        if playerRecordStamps.get(name) == recordStamp:
+            continue
+        record = readPlayerRecord(entry.path)
+        if record == None:
+            continue
+        playerRecordStamps[name] = recordStamp
+        otherPlayerRecords[name] = record
+        changed.add(name)
+
+    for name in list(otherPlayerRecords):
+        if name not in seen:
+            del otherPlayerRecords[name]
+            playerRecordStamps.pop(name, None)
+            changed.add(name)
+
+    return changed
+
+"""
+The state server speaks a very small protocol over STATE_SOCKET. Every
+request and every reply is one message: a 4 byte length followed by JSON,
+never a pickle, as anything that can reach the socket could otherwise make
+the server run code. Requests are lists of [operation, arguments...], and
+the server answers them strictly in order, so a node can send several
+requests in one go and then read all of the replies (pipelining). The
+socket is only made readable and writable by the user the server runs as.
+
+Files only this game writes, the boards and event logs, hold the same
+framing with a pickle in it; see packFrame().
+"""
+stateServer = None
+stateServerReader = None
+stateServerLock = threading.Lock()
+statePlayersGeneration = None
+
+def readFrameData(reader):
+    """Reads the data of one length prefixed frame, raising EOFError if it is cut short"""
+    header = reader.read(4)
+    if len(header) < 4:
+        raise EOFError('frame cut short')
+    size = struct.unpack('>I', header)[0]
+    data = reader.read(size)
+    if len(data) < size:
+        raise EOFError('frame cut short')
+    return data
+
+def packFrame(obj):
+    data = pickle.dumps(obj)
+    return struct.pack('>I', len(data)) + data
+
+def readFrame(reader):
+    return pickle.loads(readFrameData(reader))
+
+def packMessage(obj):
+    data = json.dumps(obj).encode('utf-8')
+    return struct.pack('>I', len(data)) + data
+
+def readMessage(reader):
+    return json.loads(readFrameData(reader).decode('utf-8'))
+
+def connectStateServer():
+    """Connects to the state server if one is running. Returns True if connected."""
+    global stateServer
+    global stateServerReader
+
+    if not os.path.exists(STATE_SOCKET):
+        return False
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(STATE_SOCKET)
+    except OSError:
+        sock.close()
+        return False
+
+    stateServer = sock
+    stateServerReader = sock.makefile('rb')
+    return True
+
+def stateRequest(*requests):
+    """Sends all of the requests to the state server in one write and returns
+    the list of replies. If the server has gone away this drops back to the
+    file based mode and returns None."""
+    global stateServer
+    global stateServerReader
+    global lastPlayerRecord
+    global playersFolderStamp
+
+    with stateServerLock:
+        if stateServer == None:
+            return None
+        try:
+            stateServer.sendall(b''.join([packMessage(request) for request in requests]))
+            return [readMessage(stateServerReader) for request in requests]
+        except (OSError, EOFError, ValueError):
+            stateServerReader.close()
+            stateServer.close()
+            stateServer = None
+            stateServerReader = None
+
+    # Make sure the files get our record and get rescanned from scratch
+    print('\n%sLost the state server, using the save files instead.%s' % (RED, WHITE))
+    lastPlayerRecord = None
+    markPlayerDirty()
+    playersFolderStamp = None
+    playerRecordStamps.clear()
+    return None
+
+def playerRecord():
+    """Returns the record other nodes see for this player"""
+    return {'Inventory': list(inventory), 'Health': playerStats['Health'], 'XP': playerStats['XP'], 'HP': playerStats['HP'], 'Money': playerStats['Money'], 'Location': playerStats['Location']}
+
+def markPlayerDirty():
+    """Notes that our record has changed, to be written by the next flush"""
+    global playerDirty
+    playerDirty = True
+
+def dueRecord(force):
+    """Returns our record if it has changed and is due to be written, otherwise None"""
+    global playerDirty
+
+    if not playerDirty and not force:
+        return None
+    record = playerRecord()
+    if record == lastPlayerRecord:
+        playerDirty = False
+        return None
+
+    died = lastPlayerRecord != None and record['Health'] < 1 <= lastPlayerRecord['Health']
+    if force or died or (time.time() - lastPlayerFlush) * 1000 >= FLUSH_INTERVAL_MS:
+        return record
+    return None
+
+def flushedRecord(record):
+    """Notes that record has just been written out"""
+    global playerDirty
+    global lastPlayerRecord
+    global lastPlayerFlush
+
+    lastPlayerRecord = record
+    lastPlayerFlush = time.time()
+    playerDirty = False
+
+"""
+Events are tuples sent to a player's own node, which is the only one that
+ever changes that player:
+
+    ('hit', attacker, damage), damage before the victim's armour
+    ('hit_result', victim, damage, health, xp, hp), what the hit did, and
+    the XP and HP the attacker gets if it killed the victim
+    ('loot', looter), asking a dead player to hand over what they carry
+    ('looted', victim, money, items), what the looter gets back
+
+Hits are sent as damage rather than the victim's new health, so any number
+of them can queue up and the attacker never has to wait for the victim to
+catch up. Only the victim's node knows their armour and health as they are
+now, so it alone decides what a hit does and tells the attacker.
+"""
+eventOffset = 0
+
+def eventLogFile(name):
+    return '%s%s.events' % (EVENTS_FOLDER, name)
+
+def openEventLog():
+    """Starts this session with an empty event log"""
+    global eventOffset
+    open(eventLogFile(playerStats['Player Name']), 'wb').close()
+    eventOffset = 0
+
+def sendEvent(who, event):
+    """Queues an event for another player without waiting for them"""
+    if stateServer != None:
+        if stateRequest(('send_event', who, event)) != None:
+            return
+    # A single O_APPEND write, so events from several nodes never interleave
+    fd = os.open(eventLogFile(who), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, packFrame(event))
+    finally:
+        os.close(fd)
+
+def readEvents():
+    """Returns the events appended to our event log since the last call"""
+    global eventOffset
+    if not os.path.exists(playerAliveFile(playerStats['Player Name'])):
+        # We have been evicted, and our log with us, so any log there is now
+        # is a new one; heartbeat() brings us back and starts it from the top
+        return []
+    try:
+        size = os.stat(eventLogFile(playerStats['Player Name'])).st_size
+    except FileNotFoundError:
+        return []
+    if size < eventOffset:
+        eventOffset = 0 # a new log that hasn't caught up with the old one
+    if size <= eventOffset:
+        return []
+
+    with open(eventLogFile(playerStats['Player Name']), 'rb') as f:
+        f.seek(eventOffset)
+        data = f.read(size - eventOffset)
+
+    events = []
+    pos = 0
+    while pos + 4 <= len(data):
+        length = struct.unpack('>I', data[pos:pos + 4])[0]
+        if pos + 4 + length > len(data):
+            break # still being written, pick it up next time
+        events.append(pickle.loads(data[pos + 4:pos + 4 + length]))
+        pos += 4 + length
+    eventOffset += pos
+    return events
+
+def applyEvents(events):
+    """Applies events sent by other players to our own stats"""
+    for event in events:
+        if event[0] == 'hit':
+            attacker = event[1]
+            damage = min(max(0, event[2] - inventory.defence), max(0, playerStats['Health']))
+            playerStats['Health'] -= damage
+            xp = 0
+            hp = 0
+            if damage > 0 and playerStats['Health'] < 1:
+                xp = playerStats['XP']
+                hp = playerStats['HP']
+                playerStats['XP'] = 0
+                playerStats['HP'] = 0
+            sendEvent(attacker, ('hit_result', playerStats['Player Name'], damage, playerStats['Health'], xp, hp))
+            print('\n%s%s just hit you, causing %d damage!%s\n' % (RED, attacker, damage, WHITE))
+            markPlayerDirty()
+        elif event[0] == 'hit_result':
+            victim, damage, health, xp, hp = event[1:]
+            if health > 0:
+                print('\nYou hit %s, causing %d damage.\n%s now has %d health.\n' % (victim, damage, victim, health))
+            elif damage > 0:
+                playerStats['XP'] += xp
+                playerStats['HP'] += hp
+                print('\nYou killed %s!\n' % (victim))
+                markPlayerDirty()
+            else:
+                print('\n%s was already dead.\n' % (victim))
+        elif event[0] == 'loot':
+            looter = event[1]
+            if playerStats['Health'] > 0:
+                continue # back on their feet since the looter last looked
+            money = playerStats['Money']
+            items = list(inventory)
+            playerStats['Money'] = 0
+            inventory.clear()
+            sendEvent(looter, ('looted', playerStats['Player Name'], money, items))
+            if money > 0 or len(items) > 0:
+                print('\n%s%s looted your body!%s\n' % (RED, looter, WHITE))
+            markPlayerDirty()
+        elif event[0] == 'looted':
+            victim, money, items = event[1:]
+            if money > 0:
+                playerStats['Money'] += money
+                print('Looted %d coins from %s' % (money, victim))
+            else:
+                print('No money to loot from %s' % (victim))
+            for item in items:
+                inventory.append(item)
+                print('Looted %s from %s' % (item, victim))
+            print('Nothing else in %s\'s inventory is worth looting.' % (victim))
+            markPlayerDirty()
+
+def syncPlayerFiles(force):
+    """Exchanges player records through PLAYERS_FOLDER.
+    Returns the set of players whose record changed, ourselves included."""
+    heartbeat()
+    evictStalePlayers()
+    changed = refreshPlayerRecords()
+
+    # Only our own record is ever written, and only when it has changed
+    record = dueRecord(force)
+    if record != None:
+        writePlayerRecord(playerStats['Player Name'], record)
+        flushedRecord(record)
+        changed.add(playerStats['Player Name'])
+
+    return changed
+
+def syncStateServer(force):
+    """Exchanges player records and hits with the state server in one round trip.
+    Returns the set of players whose record changed, ourselves included."""
+    global statePlayersGeneration
+
+    name = playerStats['Player Name']
+    record = dueRecord(force)
+
+    requests = [('take_events', name)]
+    if record != None:
+        requests.append(('put_player', name, record))
+    requests.append(('get_players', statePlayersGeneration))
+    replies = stateRequest(*requests)
+    if replies == None:
+        return set()
+    changed = set()
+    if record != None:
+        flushedRecord(record)
+        changed.add(name)
+
+    # Normally pushed straight to the EventWatcher, these are any that
+    # arrived while it wasn't subscribed
+    events = replies[0]
+    if len(events) > 0:
+        applyEvents(events)
+        record = playerRecord()
+        if stateRequest(('put_player', name, record)) != None:
+            flushedRecord(record)
+        changed.add(name)
+
+    players = replies[-1]
+    if players == None:
+        return changed # nobody changed anything since our last look
+
+    statePlayersGeneration, records = players
+    if name not in records and lastPlayerRecord != None:
+        # evicted while we were stalled, so put our record back next time
+        flushedRecord(None)
+        markPlayerDirty()
+    for player in list(otherPlayerRecords):
+        if player not in records:
+            del otherPlayerRecords[player]
+            changed.add(player)
+    for player in records:
+        if player != name and otherPlayerRecords.get(player) != records[player]:
+            otherPlayerRecords[player] = records[player]
+            changed.add(player)
+    return changed
+
+"""
+Which room every player is in. playerRooms maps each player to their room,
+and each room's OTHERPLAYERS list is the other way round. Only the rooms a
+player leaves or enters are touched, and an OTHERPLAYERS list is always
+replaced with a new one rather than changed, so anything drawing a room
+keeps a consistent snapshot even while the tick updates the index.
+"""
+playerRooms = {}
+
+def movePlayerIndex(player, room):
+    """Records that player is now in room, or gone if room is None"""
+    oldRoom = playerRooms.get(player)
+    if oldRoom == room:
+        return
+    if oldRoom != None:
+        worldRooms[oldRoom][OTHERPLAYERS] = [other for other in worldRooms[oldRoom][OTHERPLAYERS] if other != player]
+        del playerRooms[player]
+        touchRoom(oldRoom)
+    if room != None:
+        worldRooms[room][OTHERPLAYERS] = worldRooms[room][OTHERPLAYERS] + [player]
+        playerRooms[player] = room
+        touchRoom(room)
+
+def rebuildPlayerIndex():
+    """Rebuilds the whole index, for when worldRooms itself has been replaced"""
+    playerRooms.clear()
+    for room in worldRooms:
+        worldRooms[room][OTHERPLAYERS] = []
+    for player in currentPlayers:
+        movePlayerIndex(player, currentPlayers[player]['Location'])
+
+def playersInRoom(loc):
+    """Returns a snapshot of the players in loc"""
+    return worldRooms[loc][OTHERPLAYERS]
+
+def updatePlayers(force=False):
+    """Add player to currentPlayers dictionary
+
+    Our own record is only written if it is dirty and FLUSH_INTERVAL_MS has
+    passed since the last write, unless force is True."""
 
     global currentPlayers
     global playerStats
     global inventory
     global USERNAME
-    
-    playerHit_file = '%s%s_damage.sem' % (SAVES_FOLDER, playerStats['Player Name'])
-    if os.path.exists(playerHit_file) == True:
-        playerStats['Health'] = pickle.load(open(playerHit_file, 'rb'))
-        os.remove(playerHit_file)
-        print('\n%sYou were just hit!%s\n' % (RED, WHITE))
-
-    file_players = '%s%s.dat' % (SAVES_FOLDER, 'players')
-    if os.path.exists(file_players) == False:
-        currentPlayers[playerStats['Player Name']] = {'Inventory': inventory, 'Health': playerStats['Health'], 'XP': playerStats['XP'], 'HP': playerStats['HP'], 'Money': playerStats['Money'], 'Location': playerStats['Location']}
-        pickle.dump(currentPlayers, open(file_players, 'wb'))
-    else:
-        currentPlayers = pickle.load(open(file_players, 'rb'))
-        #print(playerStats)
-        #print(currentPlayers)
-        #playerStats['Health'] = int(currentPlayers[USERNAME]['Health'])
-        currentPlayers[playerStats['Player Name']] = {'Inventory': inventory, 'Health': playerStats['Health'], 'XP': playerStats['XP'], 'HP': playerStats['HP'], 'Money': playerStats['Money'], 'Location': playerStats['Location']}
-        pickle.dump(currentPlayers, open(file_players, 'wb'))
 
-    for room in worldRooms:
-        worldRooms[room][OTHERPLAYERS] = []
-
-    for player in currentPlayers:
-        worldRooms[currentPlayers[player]['Location']][OTHERPLAYERS].append(player)
+    # The prompt, the clock and the event watcher all call this, and it
+    # rewrites currentPlayers and the player index, so it holds stateLock
+    with stateLock:
+        changed = set()
+        if stateServer != None:
+            changed = syncStateServer(force)
+        if stateServer == None: # not running, or it just went away
+            changed |= syncPlayerFiles(force)
+
+        # Our own entry always comes from playerStats, which is the truth for
+        # this player; the last record flushed can be FLUSH_INTERVAL_MS
+        # behind it, and changes from other nodes come in as events
+        own = playerStats['Player Name']
+        currentPlayers[own] = playerRecord()
+        movePlayerIndex(own, playerStats['Location'])
+        changed.discard(own)
+
+        # Only the other players that changed are re-indexed
+        for player in changed:
+            if player in otherPlayerRecords:
+                currentPlayers[player] = otherPlayerRecords[player]
+            else:
+                currentPlayers.pop(player, None)
+                movePlayerIndex(player, None)
+                continue
+            movePlayerIndex(player, currentPlayers[player]['Location'])
+            touchRoom(currentPlayers[player]['Location']) # their health may have changed
 
-    playerStats['Health'] = currentPlayers[USERNAME]['Health']
-    if playerStats['Health'] < 1:
-        print('%sYou have been killed!%s' % (RED, WHITE))
-        status = '\n%sYou are dead!%s' % (RED, WHITE)
-        #os._exit(0)        
+        if playerStats['Health'] < 1:
+            print('%sYou have been killed!%s' % (RED, WHITE))
+            status = '\n%sYou are dead!%s' % (RED, WHITE)
+            #os._exit(0)        
 
     
 
 def removePlayer():
-    global location
-    worldRooms[location][OTHERPLAYERS].remove(playerStats['Player Name'])
-    del currentPlayers[playerStats['Player Name']]
+    with stateLock: # the clock may still be running
+        movePlayerIndex(playerStats['Player Name'], None)
+        currentPlayers.pop(playerStats['Player Name'], None)
 
-    file_players = '%s%s.dat' % (SAVES_FOLDER, 'players')
-    pickle.dump(currentPlayers, open(file_players, 'wb'))
+    if stateServer != None:
+        stateRequest(('remove_player', playerStats['Player Name']))
+    if stateServer == None:
+        for path in (playerRecordFile(playerStats['Player Name']), playerAliveFile(playerStats['Player Name'])):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
 
+    try:
+        os.remove(eventLogFile(playerStats['Player Name']))
+    except FileNotFoundError:
+        pass
 
 
-def displayLocation(loc):
-    """A helper function for displaying an area's description and exits."""
-    # Print the room name.
-    print(loc)
-    print('=' * len(loc))
 
-    # Print the room's description (using textwrap.wrap())
-    print('\n'.join(textwrap.wrap(worldRooms[loc][DESC], SCREEN_WIDTH)))
+"""
+What displayLocation() draws, cached. The room name and its wrapped
+description never change, so they are kept for each room by width; the
+exits for each (room, showFullExits); and the ground, NPC and player lines
+along with the room version they were drawn at.
+"""
+roomTextCache = {}
+roomExitsCache = {}
+roomSectionsCache = {}
+
+def roomText(loc, width):
+    texts = roomTextCache.setdefault(loc, {}) # by width, so a room's are all dropped together
+    if width not in texts:
+        texts[width] = '%s\n%s\n%s\n' % (loc, '=' * len(loc), '\n'.join(textwrap.wrap(worldRooms[loc][DESC], width)))
+    return texts[width]
+
+def roomExits(loc, full):
+    key = (loc, full)
+    if key not in roomExitsCache:
+        lines = []
+        exits = []
+        for direction in DIRECTIONS:
+            if direction in worldRooms[loc]:
+                lines.append('%s%s%s:\t%s\n' % (GREEN, direction.title(), WHITE, worldRooms[loc][direction]))
+                exits.append(direction.title())
+        if full:
+            roomExitsCache[key] = ''.join(lines)
+        else:
+            roomExitsCache[key] = 'Exits: %s\n' % ' '.join(exits)
+    return roomExitsCache[key]
+
+def roomSections(loc):
+    version = roomVersions.get(loc, 0)
+    cached = roomSectionsCache.get(loc)
+    if cached != None and cached[0] == version:
+        return cached[1]
 
-    # Print all the items on the ground.
+    lines = []
+    # all the items on the ground
     if len(worldRooms[loc][GROUND]) > 0:
-        print()
+        lines.append('\n')
         for item in worldRooms[loc][GROUND]:
-            print(worldItems[item][GROUNDDESC])
+            lines.append('%s\n' % (worldItems[item][GROUNDDESC]))
 
-    # Print any NPC's here
-    npcs = worldRooms[loc][NPC]
-    print()
-    for npc in npcs:
+    # any NPC's here
+    lines.append('\n')
+    for npc in worldRooms[loc][NPC]:
         if NPCs[npc]['Health'] > 0:
-            print('%s%s%s is nearby.' % (CYAN, npc, WHITE))
+            lines.append('%s%s%s is nearby.\n' % (CYAN, npc, WHITE))
         else:
-            print('%s%s%s\'s body is nearby.' % (CYAN, npc, WHITE))
-
-    # Print any Player here
-    updatePlayers()
-    players = worldRooms[loc][OTHERPLAYERS]
+            lines.append('%s%s%s\'s body is nearby.\n' % (CYAN, npc, WHITE))
 
-    for player in players:
-        if not player == USERNAME:
+    # any other player here
+    for player in playersInRoom(loc):
+        if not player == USERNAME and player in currentPlayers:
             if currentPlayers[player]['Health'] > 0:
-                print('%s%s%s is nearby.' % (YELLOW, player, WHITE))
+                lines.append('%s%s%s is nearby.\n' % (YELLOW, player, WHITE))
             else:
-                print('%s%s%s\'s body is nearby.' % (YELLOW, player, WHITE))
+                lines.append('%s%s%s\'s body is nearby.\n' % (YELLOW, player, WHITE))
 
-    # Print all the exits.
-    exits = []
-    for direction in (NORTH, SOUTH, EAST, WEST, UP, DOWN):
-        if direction in worldRooms[loc].keys():
-            exits.append(direction.title())
-    print()
-    if showFullExits:
-        for direction in (NORTH, SOUTH, EAST, WEST, UP, DOWN):
-            if direction in worldRooms[location]:
-                print('%s%s%s:\t%s' % (GREEN, direction.title(), WHITE, worldRooms[location][direction]))
-    else:
-        print('Exits: %s' % ' '.join(exits))
+    text = ''.join(lines)
+    roomSectionsCache[loc] = (version, text)
+    return text
+
+def displayLocation(loc):
+    """A helper function for displaying an area's description and exits."""
+    updatePlayers() # before drawing, so the players shown are the latest
+    if loc in templateRoomsMade:
+        templateRoomsMade[loc] = time.time()
+
+    sys.stdout.write('%s%s\n%s' % (roomText(loc, SCREEN_WIDTH), roomSections(loc), roomExits(loc, showFullExits)))
 
 
 def moveDirection(direction):
@@ -1156,9 +2180,9 @@ def moveDirection(direction):
     global location
 
     if direction in worldRooms[location]:
-        worldRooms[location][OTHERPLAYERS].remove(playerStats['Player Name'])
         print('You move to the %s.' % direction)
         location = worldRooms[location][direction]
+        playerStats['Location'] = location
         displayLocation(location)
     else:
         print('You cannot move in that direction')
@@ -1167,40 +2191,203 @@ def moveDirection(direction):
         playerStats['Health'] -= 1
 
     playerStats['Location'] = location
-    updatePlayers()
+    markPlayerDirty()
+
+ROUTE_SEARCH_MAX_ROOMS = 20000
+routeTable = world.get('routes')
+routeGraphCache = None
+routeRows = {}
+routeSearches = {}
+roomNameTrie = None
+roomLowerNames = {}
+
+def routeRow(dest):
+    """Returns the next-hop row for the room with id dest"""
+    global routeGraphCache
+
+    if routeTable != None:
+        return memoryview(routeTable)[dest * len(roomNames):(dest + 1) * len(roomNames)]
+    if dest not in routeRows:
+        if routeGraphCache == None:
+            routeGraphCache = routeGraph(worldRooms, roomNames)
+        if len(routeRows) >= 64:
+            routeRows.clear()
+        names, ids, comesFrom = routeGraphCache
+        routeRows[dest] = buildRouteRow(names, ids, comesFrom, dest)
+    return routeRows[dest]
+
+def routeExits(room):
+    """Returns the room if it has been made, or else just its exits as its
+    template makes them, so searching never makes rooms; None if there is no such room"""
+    if dict.__contains__(worldRooms, room):
+        return worldRooms[room]
+    return templateRoom(roomTemplates, room, True)
+
+def searchRoute(start, dest):
+    """Returns the directions of a shortest way from start to dest found by a
+    breadth first search, or None if there is none within ROUTE_SEARCH_MAX_ROOMS
+    rooms. For rooms the route table doesn't know, which come from templates."""
+    key = (start, dest)
+    if key in routeSearches:
+        return routeSearches[key]
+    cameFrom = {start: None}
+    queue = [start]
+    route = None
+    for room in queue:
+        if room == dest:
+            route = []
+            while cameFrom[room] != None:
+                room, direction = cameFrom[room]
+                route.append(direction)
+            route.reverse()
+            break
+        exits = routeExits(room)
+        if exits == None:
+            continue
+        for direction in DIRECTIONS:
+            nextRoom = exits.get(direction)
+            if nextRoom != None and nextRoom not in cameFrom:
+                cameFrom[nextRoom] = (room, direction)
+                queue.append(nextRoom)
+        if len(cameFrom) > ROUTE_SEARCH_MAX_ROOMS:
+            break
+    if len(routeSearches) >= 64:
+        routeSearches.clear()
+    routeSearches[key] = route # the exits never change, so neither does the route
+    return route
+
+def findRoute(start, dest):
+    """Returns the directions of a shortest way from room start to room dest, or None if there is none"""
+    if start not in roomIds or dest not in roomIds:
+        return searchRoute(start, dest) # rooms made from templates aren't in the table
+    row = routeRow(roomIds[dest])
+    room = roomIds[start]
+    route = []
+    while row[room] != ROUTE_HERE:
+        if row[room] == ROUTE_NONE or len(route) > len(roomNames):
+            return None
+        direction = DIRECTIONS[row[room]]
+        route.append(direction)
+        room = roomIds[worldRooms[roomNames[room]][direction]]
+    return route
+
+def roomNameCompletions(text):
+    """Returns the names of the rooms starting with text, ignoring case"""
+    global roomNameTrie
+
+    if roomNameTrie == None:
+        roomNameTrie = WordTrie()
+        for room in roomNames:
+            roomNameTrie.add(room.lower())
+            roomLowerNames[room.lower()] = room
+    return [roomLowerNames[room] for room in roomNameTrie.complete(text.lower())]
+
+def findRoom(name):
+    """Returns the room called name, ignoring case, or the only room whose name starts with it"""
+    name = name.strip().lower()
+    matches = roomNameCompletions(name)
+    for room in matches:
+        if room.lower() == name:
+            return room
+    if len(roomTemplates) > 0 and templateRoom(roomTemplates, name.title(), True) != None:
+        return name.title() # rooms from templates can only be named in full
+    if len(matches) == 1:
+        return matches[0]
+    return None
+
+def travel(route):
+    """Walks route a room at a time, but only draws and saves where it ends up"""
+    global location
+
+    walked = []
+    for direction in route:
+        if playerStats['Health'] < 1:
+            break
+        location = worldRooms[location][direction]
+        walked.append(direction)
+        if not godMode:
+            playerStats['Health'] -= 1
+
+    print('You go %s.' % (', '.join(walked)))
+    if len(walked) < len(route):
+        print('You are too weak to go any further.')
+    playerStats['Location'] = location
+    markPlayerDirty()
+    displayLocation(location)
 
 def getAllDescWords(itemList):
     """Returns a list of "description words" for each item named in itemList."""
-    itemList = list(set(itemList)) # make itemList unique
-    descWords = []
-    for item in itemList:
-        descWords.extend(worldItems[item][DESCWORDS])
-    return list(set(descWords))
+    if isinstance(itemList, ItemList):
+        return list(itemList.words)
+    return list(ItemList(itemList).words)
 
 def getAllFirstDescWords(itemList):
     """Returns a list of the first "description word" in the list of
     description words for each item named in itemList."""
-    itemList = list(set(itemList)) # make itemList unique
-    descWords = []
-    for item in itemList:
-        descWords.append(worldItems[item][DESCWORDS][0])
-    return list(set(descWords))
+    descWords = set()
+    for item in itemCounts(itemList):
+        descWords.add(itemDescWords[item][0])
+    return list(descWords)
 
 def getFirstItemMatchingDesc(desc, itemList):
-    itemList = list(set(itemList)) # make itemList unique
-    for item in itemList:
-        if desc in worldItems[item][DESCWORDS]:
+    counts = itemCounts(itemList)
+    for item in descWordItems.get(desc, ()):
+        if item in counts:
             return item
     return None
 
 def getAllItemsMatchingDesc(desc, itemList):
-    itemList = list(set(itemList)) # make itemList unique
+    counts = itemCounts(itemList)
     matchingItems = []
-    for item in itemList:
-        if desc in worldItems[item][DESCWORDS]:
+    for item in descWordItems.get(desc, ()):
+        if item in counts:
             matchingItems.append(item)
     return matchingItems
 
+"""
+Tab completion. Every ItemList keeps a WordTrie of its description words,
+so finding the words that start with what has been typed so far only walks
+the letters typed and the words found, however much the container holds.
+"""
+directionTrie = WordTrie(DIRECTIONS)
+
+def asItemList(itemList):
+    if isinstance(itemList, ItemList):
+        return itemList
+    return ItemList(itemList)
+
+def completeWords(text, itemLists, key=None, default=None):
+    """Returns the description words starting with text of the items in
+    itemLists, only counting items where worldItems[item].get(key, default)
+    is true if key is given"""
+    words = set()
+    for itemList in itemLists:
+        itemList = asItemList(itemList)
+        for word in itemList.trie.complete(text):
+            if key == None:
+                words.add(word)
+                continue
+            for item in descWordItems[word]:
+                if item in itemList.counts and worldItems[item].get(key, default):
+                    words.add(word)
+                    break
+    return list(words)
+
+def completeNames(text, names):
+    """Returns the names starting with text, ignoring case; rooms only ever
+    hold a few NPCs or players, so these are just checked in turn"""
+    return [name for name in set(names) if name.lower().startswith(text)]
+
+def commandComplete(line, tries):
+    """Returns True if the argument on line already starts with a whole word from one of tries"""
+    words = line.split(None, 1)
+    if len(words) < 2:
+        return False
+    for trie in tries:
+        if trie.prefixOf(words[1]):
+            return True
+    return False
+
 def updatePrompt():
     global status
     health = playerStats['Health']
@@ -1212,7 +2399,188 @@ def updatePrompt():
                     
     TextAdventureCmd.prompt = '%s\n%s[Health:%s%d%s][Money:%s%d%s]\n> %s' % (status, YELLOW, healthColour, playerStats['Health'], YELLOW, GREEN, playerStats['Money'], YELLOW, WHITE)
 
+"""
+NPCs live between commands too. Every NPC_TICK_INTERVAL game seconds the
+game clock runs one step of the simulation over every NPC at once:
+
+ * wounded NPCs that are still alive get NPC_REGEN health back, up to what
+   world.json gave them
+ * a wounded NPC in the player's room has been provoked, and if it has a
+   weapon hits back with a chance of NPC_ATTACK_CHANCE, as hard as it would
+   in a fight
+ * any other NPC that is alive wanders through a random exit of its room
+   with a chance of NPC_WANDER_CHANCE
+
+Their health, XP, HP and room are columns in npcColumns, so with numpy a
+step is a handful of array operations whatever the number of NPCs, and only
+the NPCs that hit or move are touched one by one. Without numpy the same
+step is a loop over array.arrays. The numpy step draws its numbers from a
+RandomState seeded from random, so random.seed() decides both kinds of
+step. Exits come from npcExitTable(), a row of room ids per room made the
+first time a step needs it. Rooms made from templates are not in it, so
+NPCs stay out of them.
+
+Like autosave the step skips its turn rather than wait for a command to
+finish with stateLock. Each node simulates its own copy of the NPCs.
+"""
+NPC_TICK_INTERVAL = 5
+NPC_REGEN = 1
+NPC_ATTACK_CHANCE = 0.25
+NPC_WANDER_CHANCE = 0.05
+npcClock = 0
+npcExits = None
+
+def placeNPC(npc, room):
+    worldRooms[room][NPC].append(npc)
+    npcColumns.room[npcIds[npc]] = roomIds.get(room, -1)
+    touchRoom(room)
+
+def syncNPCRooms():
+    """Sets the room column from the NPC lists of the rooms, after a load has replaced them"""
+    for npcId in range(len(npcNames)):
+        npcColumns.room[npcId] = -1
+    for room in worldRooms:
+        for npc in worldRooms[room].get(NPC, []):
+            if npc in npcIds:
+                npcColumns.room[npcIds[npc]] = roomIds.get(room, -1)
+
+def npcExitTable():
+    """Returns the room id each exit of each room leads to, or -1, as a
+    (rooms, directions) array with numpy and a flat array.array without"""
+    global npcExits
+
+    if npcExits is None:
+        exits = array.array('q', [-1]) * (len(roomNames) * len(DIRECTIONS))
+        for roomId, room in enumerate(roomNames):
+            for column, direction in enumerate(DIRECTIONS):
+                if direction in worldRooms[room]:
+                    exits[roomId * len(DIRECTIONS) + column] = roomIds.get(worldRooms[room][direction], -1)
+        if numpy != None:
+            exits = numpy.frombuffer(exits, dtype=numpy.int64).reshape(-1, len(DIRECTIONS))
+        npcExits = exits
+    return npcExits
+
+def npcStep(here):
+    """Regenerates every NPC and works out which of them attack and which
+    wander. here is the player's room id, or -2 to leave the player alone.
+    Returns the ids of the attackers and a list of (id, column of the exit)."""
+    columns = npcColumns
+    exits = npcExitTable()
+
+    if numpy != None:
+        count = len(columns.health)
+        alive = columns.health > 0
+        wounded = alive & (columns.health < columns.maxHealth)
+        provoked = wounded & (columns.room == here)
+        rng = numpy.random.RandomState(random.getrandbits(32))
+        attackers = numpy.flatnonzero(provoked & (rng.random_sample(count) < NPC_ATTACK_CHANCE))
+        columns.health[wounded] = numpy.minimum(columns.health[wounded] + NPC_REGEN, columns.maxHealth[wounded])
+        wanderers = numpy.flatnonzero(alive & ~provoked & (columns.room >= 0) & (rng.random_sample(count) < NPC_WANDER_CHANCE))
+        ways = rng.randint(0, len(DIRECTIONS), len(wanderers))
+        passable = exits[columns.room[wanderers], ways] >= 0
+        return [int(npcId) for npcId in attackers], [(int(npcId), int(way)) for npcId, way in zip(wanderers[passable], ways[passable])]
+
+    attackers = []
+    moves = []
+    for npcId in range(len(columns.health)):
+        health = columns.health[npcId]
+        if health < 1:
+            continue
+        room = columns.room[npcId]
+        if health < columns.maxHealth[npcId]:
+            columns.health[npcId] = min(health + NPC_REGEN, columns.maxHealth[npcId])
+            if room == here:
+                if random.random() < NPC_ATTACK_CHANCE:
+                    attackers.append(npcId)
+                continue
+        if room >= 0 and random.random() < NPC_WANDER_CHANCE:
+            way = random.randrange(len(DIRECTIONS))
+            if exits[room * len(DIRECTIONS) + way] >= 0:
+                moves.append((npcId, way))
+    return attackers, moves
+
+def npcAttack(npc):
+    """npc hits the player"""
+    weapon = NPCs[npc]['Inventory'].bestWeapon
+    if playerStats['Health'] < 1 or weapon == None:
+        return
+    damage = 0
+    if not godMode:
+        damage = max(0, min(hitDamage(NPCs[npc]['Inventory'], inventory), playerStats['Health']) - playerStats['HP'])
+    playerStats['Health'] -= damage
+    if playerStats['Health'] < 1:
+        playerStats['XP'] = 0
+        playerStats['HP'] = 0
+    print('\n%s%s hits you with a %s, causing %d damage!%s\n' % (RED, npc, weapon, damage, WHITE))
+    markPlayerDirty()
+    updatePrompt()
+
+def moveNPC(npc, direction):
+    """Moves npc out of its room by the exit in direction"""
+    source = roomNames[npcColumns.room[npcIds[npc]]]
+    dest = worldRooms[source][direction]
+    if npc not in worldRooms[source][NPC]:
+        npcColumns.room[npcIds[npc]] = -1 # something else moved it, leave it be
+        return
+    worldRooms[source][NPC].remove(npc)
+    touchRoom(source)
+    placeNPC(npc, dest)
+    if source == location:
+        print('\n%s%s%s wanders off to the %s.\n' % (CYAN, npc, WHITE, direction))
+    elif dest == location:
+        print('\n%s%s%s wanders in.\n' % (CYAN, npc, WHITE))
+
+def simulateNPCs():
+    """Called by the game clock once every game second"""
+    global npcClock
+
+    if NPC_TICK_INTERVAL <= 0 or len(npcNames) == 0:
+        return
+    npcClock += 1
+    if npcClock < NPC_TICK_INTERVAL:
+        return
+    if stateLock.acquire(blocking=False) == False:
+        return # try again next second
+    try:
+        npcClock = 0
+        here = -2
+        if playerStats['Health'] > 0:
+            here = roomIds.get(location, -2)
+        attackers, moves = npcStep(here)
+        for npcId in attackers:
+            npcAttack(npcNames[npcId])
+        for npcId, way in moves:
+            moveNPC(npcNames[npcId], DIRECTIONS[way])
+    finally:
+        stateLock.release()
+
+def measureWorld():
+    """Prints how long the parts of the game that grow with the world take
+    on this one. Nothing it runs reads or writes SAVES_FOLDER or talks to the
+    state server, and placeRandoms, the one part that changes the world, is
+    timed last."""
+    def measure(name, function):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        print('%-32s %10.2f ms' % (name, (time.perf_counter() - start) * 1000))
+
+    print('%s: %d rooms, %d items, %d NPCs' % (WORLD_FILE, len(worldRooms), len(worldItems), len(NPCs)))
+    far = roomNames[-1]
+    measure('loadWorld', loadWorld)
+    measure('rebuildPlayerIndex', rebuildPlayerIndex)
+    measure('checkNPCs', checkNPCs)
+    measure('worldDelta', worldDelta)
+    measure('findRoute to %s' % (far), lambda: findRoute('Town Square', far))
+    measure('findRoute again', lambda: findRoute('Town Square', far))
+    measure('roomNameCompletions', lambda: roomNameCompletions('room 1'))
+    measure('roomText, Exits and Sections', lambda: (roomText('Town Square', SCREEN_WIDTH), roomExits('Town Square', True), roomSections('Town Square')))
+    measure('npcStep', lambda: npcStep(-2))
+    measure('placeRandoms', placeRandoms)
+    measure('worldDelta after placeRandoms', worldDelta)
+
 def checkNPCs():
+        # NPCs are only ever in made rooms, see TemplatedRooms
         npcs_alive = 0
         npcs_dead = 0
         for room in worldRooms:
@@ -1229,55 +2597,321 @@ def checkNPCs():
         else:
             return False
 
+"""
+Both kinds of board are stored the same way, with a shard of two files per
+location under BOARDS_FOLDER/<kind>/, so signing or clearing a board in
+one room never touches another room's data. Every entry signed there is
+appended to <shard>.log as one frame (see packFrame) holding:
+
+    (entry id, {
+        NAME: USERNAME,
+        NODE: NODENUMB,
+        IPAD: USERIPAD,
+        UMSG: USERMESSAGE}) # notice board only
+
+and <shard>.ids gets a fixed size (entry id, offset, length) record
+pointing at it. Entry ids are the microsecond the entry was signed, bumped
+if need be so they always go up, which makes them unique and keeps the
+index sorted. Pages are found by position in the index and dates by a
+binary search through it, so neither reads more than a page of entries.
+Clearing a board truncates both files, and an entry that was there when
+a read started but is gone by the time it is read just ends the page. The
+manifest file lists which location each shard belongs to; until there is
+one nothing has ever been signed on that kind of board.
+"""
+BOARDS_FOLDER = '%s%s/' % (SAVES_FOLDER, 'boards')
+BOARD_PAGE_SIZE = 5
+BOARD_INDEX_RECORD = struct.Struct('>QQI')
+BOARD_DATE_FORMATS = ('%d-%m-%Y %H:%M:%S', '%d-%m-%Y %H:%M', '%d-%m-%Y')
+
+def boardEntryId(ts):
+    return int(ts * 1000000)
+
+def boardEntryDate(entryId):
+    return datetime.datetime.fromtimestamp(entryId / 1000000).strftime('%d-%m-%Y %H:%M:%S')
+
+def parseBoardDate(text):
+    """Returns the time written in one of BOARD_DATE_FORMATS, or None"""
+    for dateFormat in BOARD_DATE_FORMATS:
+        try:
+            return time.mktime(datetime.datetime.strptime(text.strip(), dateFormat).timetuple())
+        except ValueError:
+            pass
+    return None
+
+def boardFolder(kind):
+    folder = '%s%s/' % (BOARDS_FOLDER, kind)
+    if not os.path.exists(folder):
+        migrateBoard(kind, folder)
+    return folder
+
+def boardSigned(kind):
+    """Returns True if any kind board has ever been signed, which is when its manifest is made"""
+    return os.path.exists(boardFolder(kind) + 'manifest')
+
+def boardShard(kind, loc, folder=None):
+    """Returns the path of the shard for loc, without an extension. folder
+    is only given while a board is being migrated."""
+    if folder == None:
+        folder = boardFolder(kind)
+    slug = ''.join([c if c.isalnum() else '_' for c in loc.lower()])
+    return '%s%s-%08x' % (folder, slug, zlib.crc32(loc.encode('utf-8')))
+
+def lockedBoardShard(kind, loc, folder=None):
+    """Opens the shard's log for appending and locks it against other nodes.
+    The first time a shard is created it is added to the manifest."""
+    shard = boardShard(kind, loc, folder)
+    try:
+        fd = os.open(shard + '.log', os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL, 0o644)
+        with open(os.path.dirname(shard) + '/manifest', 'a') as manifest:
+            manifest.write('%s\t%s\n' % (os.path.basename(shard), loc))
+    except FileExistsError:
+        fd = os.open(shard + '.log', os.O_WRONLY | os.O_APPEND)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    upgradeShard(shard)
+    return shard, fd
+
+def upgradeShard(shard):
+    """Gives the entries of a shard written before entry ids existed (which
+    has a .idx of (offset, length) records) an id made from the timestamp
+    they were signed under. The caller must hold the shard's lock."""
+    if not os.path.exists(shard + '.idx'):
+        return
+    oldIndex = struct.Struct('>QI')
+    index = b''
+    lastId = 0
+    with open(shard + '.idx', 'rb') as f, open(shard + '.log', 'rb') as log:
+        for offset, length in oldIndex.iter_unpack(f.read()):
+            log.seek(offset)
+            key = readFrame(log)[0]
+            entryId = max(boardEntryId(parseBoardDate(key) or 0), lastId + 1)
+            index += BOARD_INDEX_RECORD.pack(entryId, offset, length)
+            lastId = entryId
+    with open(shard + '.ids', 'wb') as f:
+        f.write(index)
+    os.remove(shard + '.idx')
+
+def readBoardFile(kind, loc, page=1, since=None):
+    """Returns one page of (entry id, entry) pairs on the kind board at loc,
+    oldest first, and the number of entries on the board. Page 1 is the
+    latest entries. If since is given the page starts at the first entry
+    signed at or after that time instead."""
+    shard = boardShard(kind, loc)
+    if os.path.exists(shard + '.idx'):
+        os.close(lockedBoardShard(kind, loc)[1]) # upgrades it
+    try:
+        with open(shard + '.ids', 'rb') as f:
+            total = f.seek(0, os.SEEK_END) // BOARD_INDEX_RECORD.size # ignore a half written record
+
+            if since != None:
+                first = 0
+                last = total
+                while first < last:
+                    middle = (first + last) // 2
+                    f.seek(middle * BOARD_INDEX_RECORD.size)
+                    if BOARD_INDEX_RECORD.unpack(f.read(BOARD_INDEX_RECORD.size))[0] < boardEntryId(since):
+                        first = middle + 1
+                    else:
+                        last = middle
+                last = min(total, first + BOARD_PAGE_SIZE)
+            else:
+                first = max(0, total - page * BOARD_PAGE_SIZE)
+                last = max(0, total - (page - 1) * BOARD_PAGE_SIZE)
+
+            f.seek(first * BOARD_INDEX_RECORD.size)
+            index = f.read((last - first) * BOARD_INDEX_RECORD.size)
+            index = index[:len(index) - len(index) % BOARD_INDEX_RECORD.size] # cleared while we read it
+
+        entries = []
+        with open(shard + '.log', 'rb') as f:
+            for entryId, offset, length in BOARD_INDEX_RECORD.iter_unpack(index):
+                f.seek(offset)
+                try:
+                    entries.append((entryId, readFrame(f)[1]))
+                except EOFError:
+                    break # another node cleared the board while we read it
+        return entries, total
+    except FileNotFoundError:
+        return [], 0
+
+def signBoardFile(kind, loc, entry, ts=None, folder=None):
+    """Appends entry to the kind board at loc and returns its entry id"""
+    if ts == None:
+        ts = time.time()
+    shard, fd = lockedBoardShard(kind, loc, folder)
+    try:
+        entryId = boardEntryId(ts)
+        with open(shard + '.ids', 'ab+') as f:
+            size = f.seek(0, os.SEEK_END)
+            size -= size % BOARD_INDEX_RECORD.size
+            if size > 0:
+                f.seek(size - BOARD_INDEX_RECORD.size)
+                entryId = max(entryId, BOARD_INDEX_RECORD.unpack(f.read(BOARD_INDEX_RECORD.size))[0] + 1)
+            f.truncate(size)
+
+            frame = packFrame((entryId, entry))
+            os.write(fd, frame)
+            offset = os.lseek(fd, 0, os.SEEK_CUR) - len(frame)
+            f.write(BOARD_INDEX_RECORD.pack(entryId, offset, len(frame)))
+        return entryId
+    finally:
+        os.close(fd) # also releases the lock
+
+def clearBoardFile(kind, loc, folder=None):
+    shard, fd = lockedBoardShard(kind, loc, folder)
+    try:
+        try:
+            os.truncate(shard + '.ids', 0)
+        except FileNotFoundError:
+            pass
+        os.ftruncate(fd, 0)
+    finally:
+        os.close(fd)
+
+def migrateBoard(kind, folder):
+    """Makes the kind board's folder, moving into it any board left in the
+    old single files in SAVES_FOLDER. That is either one pickle of every
+    location (<kind>.dat) or one log of (location, timestamp, entry) frames
+    (<kind>.log). The log came with <kind>.tail, one pickle of the latest
+    offsets of every location that each entry signed rewrote; the .ids of
+    each shard does its job per location, so it is just deleted.
+
+    The shards are written to a folder of this node's own, which is renamed
+    into place once they are all there, and only then are the old files
+    moved out of the way. A node that stops part way through leaves the old
+    board to be migrated again, and if two nodes migrate at once the first
+    rename wins and the other throws its copy away."""
+    file_board = '%s%s.dat' % (SAVES_FOLDER, kind)
+    file_log = '%s%s.log' % (SAVES_FOLDER, kind)
+    try:
+        os.remove('%s%s.tail' % (SAVES_FOLDER, kind))
+    except FileNotFoundError:
+        pass
+    if not os.path.exists(file_board) and not os.path.exists(file_log):
+        os.makedirs(folder, exist_ok=True)
+        return
+
+    temp = '%s.%s.tmp/' % (folder[:-1], os.getpid())
+    shutil.rmtree(temp, ignore_errors=True) # left by an earlier node with our pid
+    os.makedirs(temp)
+    try:
+        with open(file_board, 'rb') as f:
+            board = pickle.load(f)
+        for loc in board:
+            for key in board[loc]:
+                signBoardFile(kind, loc, board[loc][key], parseBoardDate(key), temp)
+    except FileNotFoundError:
+        pass
+    try:
+        with open(file_log, 'rb') as f:
+            while True:
+                try:
+                    loc, key, entry = readFrame(f)
+                except EOFError:
+                    break
+                if key == None:
+                    clearBoardFile(kind, loc, temp)
+                else:
+                    signBoardFile(kind, loc, entry, parseBoardDate(key), temp)
+    except FileNotFoundError:
+        pass
+
+    try:
+        os.rename(temp, folder)
+    except OSError:
+        shutil.rmtree(temp, ignore_errors=True) # another node migrated it first
+        return
+    for path in (file_board, file_log):
+        try:
+            os.rename(path, path + '.migrated')
+        except FileNotFoundError:
+            pass
+
+def readBoard(kind, loc, page=1, since=None):
+    """Returns one page of (entry id, entry) pairs on the kind board at loc
+    and the number of entries on the board, see readBoardFile()"""
+    if stateServer != None:
+        replies = stateRequest(('board_read', kind, loc, page, since))
+        if replies != None:
+            return replies[0]
+    return readBoardFile(kind, loc, page, since)
+
+def signBoard(kind, loc, entry):
+    """Adds an entry to the kind board at loc"""
+    if stateServer != None:
+        if stateRequest(('board_sign', kind, loc, entry)) != None:
+            return
+    signBoardFile(kind, loc, entry)
+
+def clearBoard(kind, loc):
+    """Removes every entry from the kind board at loc"""
+    if stateServer != None:
+        if stateRequest(('board_clear', kind, loc)) != None:
+            return
+    clearBoardFile(kind, loc)
+
+def parseBoardQuery(arg):
+    """Turns "page N" or "since <date>" into a (page, since) pair for
+    readBoard(). Returns None if arg is neither."""
+    words = arg.split(None, 1)
+    if len(words) == 0:
+        return (1, None)
+    if words[0].lower() == 'page' and len(words) == 2 and words[1].isdigit() and int(words[1]) > 0:
+        return (int(words[1]), None)
+    if words[0].lower() == 'since' and len(words) == 2:
+        since = parseBoardDate(words[1])
+        if since != None:
+            return (1, since)
+    return None
+
+def boardHeading(name, page, since, total):
+    if since != None:
+        return 'Showing entries since %s for the %s %s\n' % (boardEntryDate(boardEntryId(since)), location, name)
+    pages = max(1, (total + BOARD_PAGE_SIZE - 1) // BOARD_PAGE_SIZE)
+    return 'Showing page %d of %d for the %s %s\n' % (page, pages, location, name)
+
 def guestbookRead(arg):
-        """Shows the entries in a guestbook"""
+        """Shows the entries in a guestbook
+        arg is "clear", or which entries to show: "page N" or "since <date>" """
 
         if worldRooms[location].get(GUESTBOOK) == None:
             print('You can\'t do that here')
             return
 
-        file_guestbook = '%s%s.dat' % (SAVES_FOLDER, 'guestbook')
-        if os.path.exists(file_guestbook) == False:
+        if boardSigned(GUESTBOOK) == False:
             print('No previous entries found')
             return
 
-        guestbook = {}
-        gb_entries = []
-        file_guestbook = '%s%s.dat' % (SAVES_FOLDER, 'guestbook')
-        guestbook = pickle.load(open(file_guestbook, 'rb'))
+        if arg.lower() == 'clear':
+            clearBoard(GUESTBOOK, location)
+            print('Guestbook for %s cleared' % (location))
+            return
 
-        if not location in guestbook.keys():
-            print('No entries in this guestbook')
+        query = parseBoardQuery(arg)
+        if query == None:
+            print('Usage: guestbook read [page N | since dd-mm-yyyy [hh:mm[:ss]]]')
             return
+        page, since = query
 
-        if arg.lower() == 'clear':
-            if location in guestbook:
-                del guestbook[location]
-                pickle.dump(guestbook, open(file_guestbook,'wb'))
-                print('Guestbook for %s cleared' % (location))
-                return
+        guestbook, total = readBoard(GUESTBOOK, location, page, since)
+        if total < 1:
+            print('No entries in this guestbook')
+            return
+        if len(guestbook) < 1:
+            print('No entries to show, this guestbook has %d' % (total))
+            return
 
-        print('Showing the last 5 entries for the %s guestbook\n' % (location))
+        print(boardHeading('guestbook', page, since, total))
         print('+--------------------------+--------------------------+---------------------+')
         print('| ' + '{:25}'.format('Date') + '| ' + '{:25}'.format('Name') + '| ' + '{:20}'.format('IP') + '|')
         print('+--------------------------+--------------------------+---------------------+')
 
-        e = 0
-        for entry in guestbook[location]:
-            gb_entries.append(entry)
-            e += 1
-
-        if e < 1:
-            return
-
-        gb_last5 = gb_entries[-5:]
-
-        for entry in gb_last5:
-            user = guestbook[location][entry]['NAME']
-            node = guestbook[location][entry]['NODE']
-            ipad = guestbook[location][entry]['IPAD']
+        for entry, signature in guestbook:
+            user = signature['NAME']
+            node = signature['NODE']
+            ipad = signature['IPAD']
 
-            entry_text = '| ' + '{:25.24}'.format(entry) + '| ' + '{:25.24}'.format(user) + '| ' + '{:20}'.format(ipad) + '|' 
+            entry_text = '| ' + '{:25.24}'.format(boardEntryDate(entry)) + '| ' + '{:25.24}'.format(user) + '| ' + '{:20}'.format(ipad) + '|' 
             print('\n'.join(textwrap.wrap(entry_text, SCREEN_WIDTH)))
         print('+--------------------------+--------------------------+---------------------+')
 
@@ -1288,102 +2922,57 @@ def guestbookSign(arg):
             print('You can\'t do that here')
             return
 
-        guestbook = {}
-
-        """
-        guestbook = {
-            'LOCATION': {
-                'timestamp': {
-                    NAME: USERNAME,
-                    NODE: NODENUMB,
-                    IPAD: USERIPAD},
-            },
-        }
-        """
-
-        file_guestbook = '%s%s.dat' % (SAVES_FOLDER, 'guestbook')
-
-        if os.path.exists(file_guestbook) == False:
+        if boardSigned(GUESTBOOK) == False:
             print('No previous entries found')
-            guestbook = {location: {}}
-        else:
-            guestbook = pickle.load(open(file_guestbook,'rb'))
-
-        ts = time.time()
-        st = datetime.datetime.fromtimestamp(ts).strftime('%d-%m-%Y %H:%M:%S')
 
-        if not location in guestbook.keys():
-            guestbook[location] = {}
-
-        guestbook[location][st] = {'NAME': USERNAME, 'NODE': NODENUMB, 'IPAD': USERIPAD}
+        signBoard(GUESTBOOK, location, {'NAME': USERNAME, 'NODE': NODENUMB, 'IPAD': USERIPAD})
         #os.system('clear')
-        pickle.dump(guestbook, open(file_guestbook,'wb'))
         print('Successfully added to the guestbook.\n')
-        guestbook = {}
-        guestbookRead('read')
+        guestbookRead('')
 
 def noticeboardRead(arg):
-        """Reads a notice board"""
-
-        """
-        noticeboard = {
-            'LOCATION': {
-                'timestamp': {
-                    NAME: USERNAME,
-                    NODE: NODENUMB,
-                    IPAD: USERIPAD,
-                    UMSG: USERMESSAGE},
-            },
-        }
-        """
+        """Reads a notice board
+        arg is "clear", or which entries to show: "page N" or "since <date>" """
 
         if worldRooms[location].get(NOTICEBOARD) == None:
             print('You can\'t do that here')
             return
 
-        file_noticeboard = '%s%s.dat' % (SAVES_FOLDER, 'noticeboard')
-        if os.path.exists(file_noticeboard) == False:
+        if boardSigned(NOTICEBOARD) == False:
             print('No previous entries found')
             return
 
-        noticeboard = {}
-        nb_entries = []
-        #file_noticeboard = '%s%s.dat' % (SAVES_FOLDER, 'noticeboard')
-        noticeboard = pickle.load(open(file_noticeboard, 'rb'))
+        if arg.lower() == 'clear':
+            clearBoard(NOTICEBOARD, location)
+            print('Notice board for %s cleared' % (location))
+            return
 
-        if not location in noticeboard.keys():
-            print('No entries in this notice board')
+        query = parseBoardQuery(arg)
+        if query == None:
+            print('Usage: noticeboard read [page N | since dd-mm-yyyy [hh:mm[:ss]]]')
             return
+        page, since = query
 
-        if arg.lower() == 'clear':
-            if location in noticeboard:
-                del noticeboard[location]
-                pickle.dump(noticeboard, open(file_noticeboard,'wb'))
-                print('Notice board for %s cleared' % (location))
-                return
+        noticeboard, total = readBoard(NOTICEBOARD, location, page, since)
+        if total < 1:
+            print('No entries in this notice board')
+            return
+        if len(noticeboard) < 1:
+            print('No entries to show, this notice board has %d' % (total))
+            return
 
-        print('Showing the last 5 entries for the %s notice board\n' % (location))
+        print(boardHeading('notice board', page, since, total))
         print('+---------------------+----------------+--------------------------------------+')
         print('| ' + '{:20}'.format('Date') + '| ' + '{:15}'.format('Name') + '| ' + '{:37}'.format('Message') + '|')
         print('+---------------------+----------------+--------------------------------------+')
 
-        e = 0
-        for entry in noticeboard[location]:
-            nb_entries.append(entry)
-            e += 1
+        for entry, notice in noticeboard:
+            user = notice['NAME']
+            node = notice['NODE']
+            ipad = notice['IPAD']
+            umsg = notice['UMSG']
 
-        if e < 1:
-            return
-
-        nb_last5 = nb_entries[-5:]
-
-        for entry in nb_last5:
-            user = noticeboard[location][entry]['NAME']
-            node = noticeboard[location][entry]['NODE']
-            ipad = noticeboard[location][entry]['IPAD']
-            umsg = noticeboard[location][entry]['UMSG']
-
-            entry_text = '| ' + '{:20.19}'.format(entry) + '| ' + '{:15.14}'.format(user) + '| ' + '{:37.36}'.format(umsg) + '|' 
+            entry_text = '| ' + '{:20.19}'.format(boardEntryDate(entry)) + '| ' + '{:15.14}'.format(user) + '| ' + '{:37.36}'.format(umsg) + '|' 
             print('\n'.join(textwrap.wrap(entry_text, SCREEN_WIDTH)))
         print('+---------------------+----------------+--------------------------------------+')
 
@@ -1394,33 +2983,8 @@ def noticeboardSign(arg):
             print('You can\'t do that here')
             return
 
-        noticeboard = {}
-
-        """
-        noticeboard = {
-            'LOCATION': {
-                'timestamp': {
-                    NAME: USERNAME,
-                    NODE: NODENUMB,
-                    IPAD: USERIPAD,
-                    UMSG: USERMESSAGE},
-            },
-        }
-        """
-
-        file_noticeboard = '%s%s.dat' % (SAVES_FOLDER, 'noticeboard')
-
-        if os.path.exists(file_noticeboard) == False:
+        if boardSigned(NOTICEBOARD) == False:
             print('No previous entries found')
-            noticeboard = {location: {}}
-        else:
-            noticeboard = pickle.load(open(file_noticeboard,'rb'))
-
-        ts = time.time()
-        st = datetime.datetime.fromtimestamp(ts).strftime('%d-%m-%Y %H:%M:%S')
-
-        if not location in noticeboard.keys():
-            noticeboard[location] = {}
 
         is_ok = False
         while not is_ok:
@@ -1430,12 +2994,206 @@ def noticeboardSign(arg):
             if check.lower() == 'q': return
             if check.lower() == 'y': is_ok = True
 
-        noticeboard[location][st] = {'NAME': USERNAME, 'NODE': NODENUMB, 'IPAD': USERIPAD, 'UMSG': USERMESSAGE}
+        signBoard(NOTICEBOARD, location, {'NAME': USERNAME, 'NODE': NODENUMB, 'IPAD': USERIPAD, 'UMSG': USERMESSAGE})
         #os.system('clear')
-        pickle.dump(noticeboard, open(file_noticeboard,'wb'))
         print('Successfully added to the notice board.\n')
-        noticeboard = {}
-        noticeboardRead('read')
+        noticeboardRead('')
+
+"""
+The state server itself. It keeps the shared tables in memory and answers
+the requests sent by stateRequest(). Boards are still written through to
+their shards so nothing is lost when the server stops, but the latest page
+of each board is kept in memory.
+"""
+serverLock = threading.Lock()
+serverPlayers = {}
+serverGeneration = 0
+serverEvents = {}
+serverSubscribers = {}
+serverHeartbeats = {}
+serverLastEviction = 0
+serverBoards = {}
+
+def evictServerPlayers():
+    """Drops every player the server has not heard from for PLAYER_TTL seconds"""
+    global serverGeneration
+    global serverLastEviction
+
+    now = time.time()
+    if now - serverLastEviction < EVICT_INTERVAL:
+        return
+    serverLastEviction = now
+    for name in list(serverPlayers):
+        if now - serverHeartbeats.get(name, 0) > PLAYER_TTL:
+            del serverPlayers[name]
+            serverHeartbeats.pop(name, None)
+            serverEvents.pop(name, None)
+            serverGeneration += 1
+            try:
+                os.remove(eventLogFile(name)) # hits sent while the server was down
+            except FileNotFoundError:
+                pass
+
+def serverBoard(kind, loc):
+    if not (kind, loc) in serverBoards:
+        serverBoards[(kind, loc)] = readBoardFile(kind, loc)
+    return serverBoards[(kind, loc)]
+
+def serverBoardSigned(kind, loc, entryId, entry):
+    """Adds a newly signed entry to the board's cached latest page"""
+    entries, total = serverBoard(kind, loc)
+    serverBoards[(kind, loc)] = ((entries + [(entryId, entry)])[-BOARD_PAGE_SIZE:], total + 1)
+
+def handleStateRequest(request):
+    """Applies one request to the server's tables and returns the reply"""
+    global serverGeneration
+
+    op = request[0]
+    if op == 'put_player':
+        serverPlayers[request[1]] = request[2]
+        serverHeartbeats[request[1]] = time.time()
+        serverGeneration += 1
+        return serverGeneration
+    if op == 'remove_player':
+        if serverPlayers.pop(request[1], None) != None:
+            serverGeneration += 1
+        serverEvents.pop(request[1], None)
+        serverHeartbeats.pop(request[1], None)
+        return serverGeneration
+    if op == 'get_players':
+        evictServerPlayers()
+        if request[1] == serverGeneration:
+            return None
+        return (serverGeneration, dict(serverPlayers))
+    if op == 'send_event':
+        subscriber = serverSubscribers.get(request[1])
+        if subscriber != None:
+            try:
+                subscriber.write(packMessage(request[2]))
+                subscriber.flush()
+                return True
+            except OSError:
+                del serverSubscribers[request[1]]
+        serverEvents.setdefault(request[1], []).append(request[2])
+        return True
+    if op == 'take_events':
+        # every node sends this on every tick, so it doubles as the heartbeat
+        if request[1] in serverPlayers:
+            serverHeartbeats[request[1]] = time.time()
+        return serverEvents.pop(request[1], [])
+    if op == 'board_read':
+        if request[3] == 1 and request[4] == None:
+            return serverBoard(request[1], request[2])
+        return readBoardFile(request[1], request[2], request[3], request[4])
+    if op == 'board_sign':
+        serverBoard(request[1], request[2])
+        entryId = signBoardFile(request[1], request[2], request[3])
+        serverBoardSigned(request[1], request[2], entryId, request[3])
+        return entryId
+    if op == 'board_clear':
+        clearBoardFile(request[1], request[2])
+        serverBoards[(request[1], request[2])] = ([], 0)
+        return True
+    return None
+
+class StateServerHandler(socketserver.StreamRequestHandler):
+    """Serves one node's connection. Replies go out in the order the
+    requests came in, which is what lets the nodes pipeline them."""
+
+    def handle(self):
+        subscribed = None
+        while True:
+            try:
+                request = readMessage(self.rfile)
+            except (EOFError, OSError, ValueError):
+                break
+            with serverLock:
+                if request[0] == 'subscribe':
+                    # From now on this connection only carries pushed events
+                    subscribed = request[1]
+                    serverSubscribers[subscribed] = self.wfile
+                    for event in serverEvents.pop(subscribed, []):
+                        self.wfile.write(packMessage(event))
+                    self.wfile.flush()
+                    continue
+                reply = handleStateRequest(request)
+            self.wfile.write(packMessage(reply))
+            self.wfile.flush()
+
+        with serverLock:
+            if subscribed != None and serverSubscribers.get(subscribed) is self.wfile:
+                del serverSubscribers[subscribed]
+
+def runStateServer():
+    """Runs the state server until it is interrupted"""
+    if connectStateServer():
+        print('A state server is already running on %s' % (STATE_SOCKET))
+        return
+    if os.path.exists(STATE_SOCKET):
+        os.remove(STATE_SOCKET) # left behind by a server that crashed
+
+    oldUmask = os.umask(0o177) # so the socket is made 0600, with no moment when others could connect
+    try:
+        server = socketserver.ThreadingUnixStreamServer(STATE_SOCKET, StateServerHandler)
+    finally:
+        os.umask(oldUmask)
+    server.daemon_threads = True
+    print('State server listening on %s' % (STATE_SOCKET))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(STATE_SOCKET)
+
+class EventWatcher(object):
+    """ Delivers hits from other players as soon as they land.
+    With a state server they are pushed down a connection of our own,
+    otherwise our event log is checked for appends every interval.
+    """
+
+    def __init__(self, interval=EVENT_POLL_INTERVAL):
+        """ Constructor
+        :type interval: float
+        :param interval: Event log check interval, in seconds
+        """
+        self.interval = interval
+
+        thread = threading.Thread(target=self.run, args=())
+        thread.daemon = True                            # Daemonize thread
+        thread.start()                                  # Start the execution
+
+    def deliver(self, events):
+        with stateLock:
+            applyEvents(events)
+            updatePlayers(force=True) # other nodes need to see a hit straight away
+            updatePrompt()
+
+    def subscribe(self):
+        """ Receives pushed events until the state server goes away """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(STATE_SOCKET)
+            sock.sendall(packMessage(('subscribe', playerStats['Player Name'])))
+            reader = sock.makefile('rb')
+            while True:
+                self.deliver([readMessage(reader)])
+        except (OSError, EOFError, ValueError):
+            pass
+        finally:
+            sock.close()
+
+    def run(self):
+        """ Method that runs forever """
+        while True:
+            if stateServer != None:
+                self.subscribe()
+            events = readEvents()
+            if len(events) > 0:
+                self.deliver(events)
+            time.sleep(self.interval)
+
 
 class ThreadingExample(object):
     """ Threading example class
@@ -1473,8 +3231,17 @@ class ThreadingExample(object):
                     gameMinutes = 0
                     gameHours += 1
                     
-            updatePlayers()
-            updatePrompt()
+            # a command waiting on input() keeps hold of the lock, so
+            # rather than stall the clock the players wait until next second
+            if stateLock.acquire(blocking=False):
+                try:
+                    updatePlayers()
+                    updatePrompt()
+                finally:
+                    stateLock.release()
+            autosave()
+            evictTemplateRooms()
+            simulateNPCs()
             
 
 class TextAdventureCmd(cmd.Cmd):        
@@ -1485,6 +3252,11 @@ class TextAdventureCmd(cmd.Cmd):
     def default(self, arg):
         print('I do not understand that command. Type "help" for a list of commands.')
 
+    # Commands run holding stateLock so that autosave never copies the game half way through one.
+    def onecmd(self, line):
+        with stateLock:
+            return cmd.Cmd.onecmd(self, line)
+
     # A very simple "quit" command to terminate the program:
     def do_quit(self, arg):
         """Quit the game."""
@@ -1496,10 +3268,13 @@ class TextAdventureCmd(cmd.Cmd):
 
     def do_guestbook(self, arg):
         """Do something with a guestbook
-Usage: guestbook {read|sign}
-where read is to read a guestbook and sign is to sign a guestbook"""
-        if arg.lower() == "read":
-            guestbookRead(arg)
+Usage: guestbook {read [page N | since <date>]|sign}
+where read is to read a guestbook and sign is to sign a guestbook.
+read shows the latest entries, "page 2" the ones before those and so on,
+and "since dd-mm-yyyy [hh:mm[:ss]]" the entries from that date on"""
+        words = arg.split(None, 1)
+        if len(words) > 0 and words[0].lower() == "read":
+            guestbookRead(arg[len(words[0]):].strip())
         if arg.lower() == "sign":
             guestbookSign(arg)
         if arg == "CLEAR":
@@ -1511,10 +3286,13 @@ where read is to read a guestbook and sign is to sign a guestbook"""
 
     def do_noticeboard(self, arg):
         """Do something with a notice board
-Usage: noticeboard {read|sign}
-where read is to read a noticeboard and sign is to sign a noticeboard"""
-        if arg.lower() == "read":
-            noticeboardRead(arg)
+Usage: noticeboard {read [page N | since <date>]|sign}
+where read is to read a noticeboard and sign is to sign a noticeboard.
+read shows the latest entries, "page 2" the ones before those and so on,
+and "since dd-mm-yyyy [hh:mm[:ss]]" the entries from that date on"""
+        words = arg.split(None, 1)
+        if len(words) > 0 and words[0].lower() == "read":
+            noticeboardRead(arg[len(words[0]):].strip())
         if arg.lower() == "sign":
             noticeboardSign(arg)
         if arg == "CLEAR":
@@ -1533,63 +3311,89 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
         global NPCs
         global location
 
-        #save player stats to file playername.playerStats
-        file = '%s%s.%s' % (SAVES_FOLDER, USERNAME, 'playerStats')
-        pickle.dump(playerStats, open(file,'wb'))
-
-        #save player inventory to file playername.inventory
-        file = '%s%s.%s' % (SAVES_FOLDER, USERNAME, 'inventory')
-        pickle.dump(inventory, open(file,'wb'))
-
-        #save current worldRooms data to file playername.worldRooms
-        file = '%s%s.%s' % (SAVES_FOLDER, USERNAME, 'worldRooms')
-        pickle.dump(worldRooms, open(file,'wb'))
-
-        #save current NPCs data to file playername.NPCs
-        file = '%s%s.%s' % (SAVES_FOLDER, USERNAME, 'NPCs')
-        pickle.dump(NPCs, open(file,'wb'))
+        #save player stats, inventory and what has changed in the world to playername.save
+        writeSave(saveFile(USERNAME), {'playerStats': playerStats, 'inventory': list(inventory), 'world': worldDelta()})
 
         print('Saved all data')
 
 
     def do_load(self, arg):
-        """Load all the previously saved data from a player save"""
+        """Load all the previously saved data from a player save, or "load autosave" to load the last autosave"""
         global playerStats
         global inventory
         global worldRooms
         global NPCs
         global location
 
+        file_save  = saveFile(USERNAME)
         file_stats = '%s%s.%s' % (SAVES_FOLDER, USERNAME, 'playerStats')
         file_inven = '%s%s.%s' % (SAVES_FOLDER, USERNAME, 'inventory')
+        file_world = '%s%s.%s' % (SAVES_FOLDER, USERNAME, 'world')
         file_rooms = '%s%s.%s' % (SAVES_FOLDER, USERNAME, 'worldRooms')
         file_npcs  = '%s%s.%s' % (SAVES_FOLDER, USERNAME, 'NPCs')
 
+        if arg.strip().lower() == 'autosave':
+            file_save = autosaveFile(USERNAME)
+            if os.path.exists(file_save) == False:
+                print('No autosave found')
+                return
+
+        if os.path.exists(file_save):
+            try:
+                save = readSave(file_save, ['playerStats', 'inventory', 'world'])
+            except (ValueError, EOFError, struct.error, zlib.error, pickle.UnpicklingError) as e:
+                print('Your save could not be loaded: %s' % (e))
+                return
+            playerStats = save['playerStats']
+            inventory = ItemList(save['inventory'])
+            applyWorldDelta(save['world'])
+
         #check if a file exists, if not, assume that no save has been done before and return message saying no previous save
-        if os.path.exists(file_stats) == False:
+        elif os.path.exists(file_stats) == False:
             print('No previous saves found')
             return
 
-
-        #load player stats from file playername.playerStats
-        playerStats = pickle.load(open(file_stats,'rb'))
-
-        #load player inventory from file playername.inventory
-        inventory = pickle.load(open(file_inven,'rb'))
-
-        #load worldRooms from file playername.worldRooms
-        worldRooms = pickle.load(open(file_rooms,'rb'))
-
-        #load NPCs from file playername.NPCs
-        NPCs = pickle.load(open(file_npcs,'rb'))
+        #saves from before playername.save are split over several files
+        else:
+            playerStats = pickle.load(open(file_stats,'rb'))
+            inventory = ItemList(pickle.load(open(file_inven,'rb')))
+            if os.path.exists(file_world):
+                applyWorldDelta(pickle.load(open(file_world,'rb')))
+            else:
+                worldRooms = pickle.load(open(file_rooms,'rb'))
+                savedNPCs = pickle.load(open(file_npcs,'rb'))
+                for npc in savedNPCs:
+                    if npc in NPCs:
+                        NPCs[npc].update(savedNPCs[npc]) # keep the records, their stats live in npcColumns
+                syncNPCRooms()
+                rebuildPlayerIndex() # the saved worldRooms has stale player lists
+                for room in worldRooms:
+                    indexItemLists(room)
 
         #print('%s\n%s\n%s' % (playerStats, worldRooms, NPCs))
         location = playerStats['Location']
 
-        updatePlayers()
+        markPlayerDirty()
+        updatePlayers(force=True)
         updatePrompt()
         print('Loaded all data')
 
+    def do_saves(self, arg):
+        """List every save with who made it, where and when, or "saves check" to also check that none of them are damaged"""
+        saves, broken = listSaves(arg.strip().lower() == 'check')
+        if len(saves) == 0 and len(broken) == 0:
+            print('No saves found')
+            return
+
+        for name, header in saves:
+            saved = datetime.datetime.fromtimestamp(header['Saved']).strftime('%d-%m-%Y %H:%M:%S')
+            print('%s%-24s%s %-16s %-20s %s%6d%s  %s' % (YELLOW, name, WHITE, header['Player Name'], header['Location'], GREEN, header['Money'], WHITE, saved))
+        for name, reason in broken:
+            print('%s%-24s%s %s' % (RED, name, WHITE, reason))
+
+    def complete_saves(self, text, line, begidx, endidx):
+        return [option for option in ['check'] if option.startswith(text)]
+
 
     def do_godMode(self, arg):
         """Enable / Disable God Mode (i.e. don't lose health over time)"""
@@ -1626,6 +3430,10 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
     def help_hit(self):
         print('Use \'hit\' to hit a character.')
 
+    def complete_hit(self, text, line, begidx, endidx):
+        # NPCs and other players here whose names match the command text so far:
+        return completeNames(text.lower(), worldRooms[location][NPC] + playersInRoom(location))
+
     def do_hit(self, arg):
         who = arg
         who_exists = False
@@ -1654,54 +3462,19 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
             print('No one to hit')
             return
 
-        weaponsList = {}
-        npcWeaponsList = {}
-
-        swordCount = 0
-        waraxeCount = 0
-        weaponCount = 0
+        bestWeapon = inventory.bestWeapon
+        bestWeaponDamage = inventory.maxDamage
 
         if who_hitting == 'npc':
-            npcSwordCount = 0
-            npcWarAxeCount = 0
-            npcWeaponCount = 0
-
-            for item in inventory:
-                if item == 'Sword' or item == 'Great Sword':
-                    swordCount += 1
-                    weaponsList.__setitem__(item, worldItems[item][DAMAGE])
-                if item == 'War Axe':
-                    waraxeCount += 1
-                    weaponsList.__setitem__(item, worldItems[item][DAMAGE])
-
-            for npcItem in NPCs[who]['Inventory']:
-                if npcItem == 'Sword' or npcItem == 'Great Sword':
-                    npcSwordCount += 1
-                    npcWeaponsList.__setitem__(npcItem, worldItems[npcItem][DAMAGE])
-                if npcItem == 'War Axe':
-                    npcWarAxeCount += 1
-                    npcWeaponsList.__setitem__(npcItem, worldItems[npcItem][DAMAGE])
-
-            weaponCount = swordCount + waraxeCount
-            npcWeaponCount = npcSwordCount + npcWarAxeCount
-
-            bestWeapon = max(weaponsList, key=lambda key: weaponsList[key])
-            bestWeaponDamage = worldItems[bestWeapon][DAMAGE]
-
-            npcBestWeapon = max(npcWeaponsList, key=lambda key: npcWeaponsList[key])
-            npcBestWeaponDamage = worldItems[npcBestWeapon][DAMAGE]
-
-            if weaponCount > 0:
-                canFight = True
-            else:
-                canFight = False
+            npcInventory = NPCs[who]['Inventory']
+            npcBestWeapon = npcInventory.bestWeapon
 
-            if canFight == True:
+            if bestWeapon != None:
                 if who in worldRooms[location][NPC]:
                     if NPCs[who]['Health'] > 0:
-                        dam = random.randint(0, worldItems[bestWeapon][DAMAGE]) # - random.randint(0, NPCs[who]['HP']))
+                        dam = hitDamage(inventory, npcInventory)
                         if godMode == False:
-                            pdam = random.randint(0, (worldItems[npcBestWeapon][DAMAGE])) # - random.randint(0, playerStats['HP']))
+                            pdam = hitDamage(npcInventory, inventory)
                         else:
                             pdam = 0
                         if dam > NPCs[who]['Health']:
@@ -1711,16 +3484,18 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
                             NPCs[who]['XP'] = 0
                             NPCs[who]['HP'] = 0
                         NPCs[who]['Health'] -= dam 
+                        touchRoom(location)
                         if NPCs[who]['Health'] > 0:
                             print('You hit %s with a %s (MAX damage: %s), causing %d damage.\n%s now has %d health.' % (who, bestWeapon, bestWeaponDamage, dam, who, NPCs[who]['Health']))
                         else:
                             print('You killed %s!' % (who))
-                        if NPCs[who]['Health'] > 0:
+                        if NPCs[who]['Health'] > 0 and npcBestWeapon != None:
                             if pdam > playerStats['Health']:
                                 pdam = playerStats['Health']
                             if pdam > playerStats['HP']:
                                 playerStats['Health'] -= pdam - playerStats['HP']
                             print('%s hit you with a %s causing %d damage.' % (who, npcBestWeapon, pdam))
+                        markPlayerDirty()
                     else:
                         print('%s is dead.' % (who))
                 else:
@@ -1732,48 +3507,14 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
             #print('Can\'t hit players in this version')
             #return
 
-            for item in inventory:
-                if item == 'Sword' or item == 'Great Sword':
-                    swordCount += 1
-                    weaponsList.__setitem__(item, worldItems[item][DAMAGE])
-                if item == 'War Axe':
-                    waraxeCount += 1
-                    weaponsList.__setitem__(item, worldItems[item][DAMAGE])
-
-            weaponCount = swordCount + waraxeCount
-            bestWeapon = max(weaponsList, key=lambda key: weaponsList[key])
-            bestWeaponDamage = worldItems[bestWeapon][DAMAGE]
-
-            if weaponCount > 0:
-                canFight = True
-            else:
-                canFight = False
-
-            been_hit = False
-            playerHit_file = '%s%s_damage.sem' % (SAVES_FOLDER, who)
-            if os.path.exists(playerHit_file):
-                been_hit = True
-                print('%s has not updated their screen yet' % (who))
-                return
-                
-            if canFight == True:
+            if bestWeapon != None:
                 if who in worldRooms[location][OTHERPLAYERS]:
                     if currentPlayers[who]['Health'] > 0:
-                        dam = random.randint(0, worldItems[bestWeapon][DAMAGE]) # - random.randint(0, NPCs[who]['HP']))
-                        if dam > currentPlayers[who]['Health']:
-                            dam = currentPlayers[who]['Health']
-                            playerStats['XP'] += currentPlayers[who]['XP']
-                            playerStats['HP'] += currentPlayers[who]['HP']
-                            currentPlayers[who]['XP'] = 0
-                            currentPlayers[who]['HP'] = 0
-                        currentPlayers[who]['Health'] -= dam 
-                        file_players = '%s%s.dat' % (SAVES_FOLDER, 'players')
-                        pickle.dump(currentPlayers[who]['Health'], open(playerHit_file, 'wb'))
-                        pickle.dump(currentPlayers, open(file_players, 'wb'))
-                        if currentPlayers[who]['Health'] > 0:
-                            print('You hit %s with a %s (MAX damage: %s), causing %d damage.\n%s now has %d health.' % (who, bestWeapon, bestWeaponDamage, dam, who, currentPlayers[who]['Health']))
-                        else:
-                            print('You killed %s!' % (who))
+                        # the victim's own node takes off what their armour
+                        # stops, rewrites their record and sends back a
+                        # hit_result, which is when any XP and HP are ours
+                        sendEvent(who, ('hit', playerStats['Player Name'], random.randint(0, bestWeaponDamage)))
+                        print('You hit %s with a %s (MAX damage: %s).' % (who, bestWeapon, bestWeaponDamage))
                     else:
                         print('%s is dead.' % (who))
                 else:
@@ -1781,15 +3522,59 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
             else:
                 print('You have nothing to hit %s with.' % (who))
 
-            updatePlayers()
-
         if not godMode:
             playerStats['Health'] -= 1
+            markPlayerDirty()
             updatePrompt()
 
+        if who_hitting == 'player':
+            updatePlayers(force=True) # PvP has to show up on other nodes straight away
+
         if checkNPCs == True:
             print('Congratulations, you have defeated all the\nenemies and have won the game!')
 
+    def do_goto(self, arg):
+        """"goto <room>" - go to a room by the shortest way there. Every room on the way costs health as usual."""
+        if playerStats['Health'] < 1:
+            print('You are too weak to move, you should probably eat something.')
+            return
+        room = self.routeTo(arg)
+        if room == None:
+            return
+        travel(findRoute(location, room))
+
+    def do_route(self, arg):
+        """"route <room>" - show the shortest way to a room from here."""
+        room = self.routeTo(arg)
+        if room == None:
+            return
+        route = findRoute(location, room)
+        print('To get to %s: %s (%d moves)' % (room, ', '.join(route), len(route)))
+
+    def routeTo(self, arg):
+        """Returns the room named in arg if there is a way to it from here, otherwise says why not"""
+        if arg.strip() == '':
+            print('Where to? Type "goto" or "route" and the name of a room.')
+            return None
+        room = findRoom(arg)
+        if room == None:
+            print('There is no one room called "%s".' % (arg.strip()))
+            return None
+        if room == location:
+            print('You are already at %s.' % (room))
+            return None
+        if findRoute(location, room) == None:
+            print('There is no way to %s from here.' % (room))
+            return None
+        return room
+
+    def complete_goto(self, text, line, begidx, endidx):
+        # room names can have spaces in, so match on everything after the command and hand back the rest of the current word
+        typed = line.split(None, 1)[1] if len(line.split(None, 1)) > 1 else ''
+        return [room[len(typed) - len(text):] for room in roomNameCompletions(typed)]
+
+    complete_route = complete_goto
+
     # These direction commands have a long (i.e. north) and show (i.e. n) form.
     # Since the code is basically the same, I put it in the moveDirection()
     # function.
@@ -1906,7 +3691,7 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
                 if lootMoney > 0:
                     NPCs[item]['Money'] -= lootMoney
                     playerStats['Money'] += lootMoney
-                    updatePlayers()
+                    markPlayerDirty()
                     updatePrompt()
                     print('Looted %d coins from %s' % (lootMoney, item))
                 else:
@@ -1923,37 +3708,18 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
             else:
                 print('Cannot loot as %s is not dead!' % (item))
         if item in worldRooms[location][OTHERPLAYERS]:
-            lootMoney = currentPlayers[item]['Money']
-            lootInv = len(currentPlayers[item]['Inventory'])
             healthPlayer = currentPlayers[item]['Health']
             
             if healthPlayer < 1:
-                # steal player's money
-                if lootMoney > 0:
-                    currentPlayers[item]['Money'] -= lootMoney
-                    playerStats['Money'] += lootMoney
-                    updatePlayers()
-                    updatePrompt()
-                    print('Looted %d coins from %s' % (lootMoney, item))
-                else:
-                    print('No money to loot from %s' % (item))
-                    
-                # steal all items in player's inventory
-                if lootInv > 0:
-                    for invItem in currentPlayers[item]['Inventory']:
-                        inventory.append(invItem)
-                        currentPlayers[item]['Inventory'].remove(invItem)
-                        print('Looted %s from %s' % (invItem, item))
-                    else:
-                        currentPlayers[item]['Inventory'] = []
-                print('Nothing else in %s\'s inventory is worth looting.' % (arg))
+                # only their own node can take their money and items, so
+                # ask it to, and the 'looted' event that comes back says what we got
+                sendEvent(item, ('loot', playerStats['Player Name']))
             else:
                 print('Cannot loot as %s is not dead!' % (item))
         else:
             print('%s is not nearby.' % (item))
             
-        file_players = '%s%s.dat' % (SAVES_FOLDER, 'players')
-        pickle.dump(currentPlayers, open(file_players, 'wb'))
+        markPlayerDirty()
 
     def do_take(self, arg):
         """"take <item> - Take an item on the ground."""
@@ -1976,10 +3742,10 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
             worldRooms[location][GROUND].remove(item) # remove from the ground
             if worldItems[item][TYPE] == 'playerStats':
                 playerStats[item] += 1
-                updatePlayers()
                 updatePrompt()
             else:
                 inventory.append(item) # add to inventory
+            markPlayerDirty()
             return
 
         if cantTake:
@@ -2007,58 +3773,36 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
         if item != None:
             print('You drop %s.' % (worldItems[item][SHORTDESC]))
             inventory.remove(item) # remove from inventory
+            markPlayerDirty()
             worldRooms[location][GROUND].append(item) # add to the ground
 
 
     def complete_take(self, text, line, begidx, endidx):
-        possibleItems = []
         text = text.lower()
 
         # if the user has only typed "take" but no item name:
         if not text:
             return getAllFirstDescWords(worldRooms[location][GROUND])
 
-        # otherwise, get a list of all "description words" for ground items matching the command text so far:
-        for item in list(set(worldRooms[location][GROUND])):
-            for descWord in worldItems[item][DESCWORDS]:
-                if descWord.startswith(text) and worldItems[item].get(TAKEABLE, True):
-                    possibleItems.append(descWord)
-
-        return list(set(possibleItems)) # make list unique
+        # otherwise, get the "description words" of takeable ground items matching the command text so far:
+        return completeWords(text, [worldRooms[location][GROUND]], TAKEABLE, True)
 
     def complete_loot(self, text, line, begidx, endidx):
-        possibleNPCs = []
-        text = text.lower()
-
-        # if the user has only typed "loot" but no NPC name:
-        if not text:
-            for npc in worldRooms[location][NPC]:
-                possibleNPCs.append(npc)
-            return possibleNPCs
-
-        return list(set(possibleNPCs)) # make list unique 
+        # NPCs here whose names match the command text so far, or all of them if there is none yet:
+        return completeNames(text.lower(), worldRooms[location][NPC])
 
     def complete_drop(self, text, line, begidx, endidx):
-        possibleItems = []
         itemToDrop = text.lower()
 
-        # get a list of all "description words" for each item in the inventory
-        invDescWords = getAllDescWords(inventory)
-
-        for descWord in invDescWords:
-            if line.startswith('drop %s' % (descWord)):
-                return [] # command is complete
+        if commandComplete(line, [inventory.trie]):
+            return [] # command is complete
 
         # if the user has only typed "drop" but no item name:
         if itemToDrop == '':
             return getAllFirstDescWords(inventory)
 
         # otherwise, get a list of all "description words" for inventory items matching the command text so far:
-        for descWord in invDescWords:
-            if descWord.startswith(text):
-                possibleItems.append(descWord)
-
-        return list(set(possibleItems)) # make list unique
+        return completeWords(itemToDrop, [inventory])
 
 
     def do_look(self, arg):
@@ -2125,50 +3869,28 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
 
 
     def complete_look(self, text, line, begidx, endidx):
-        possibleItems = []
         lookingAt = text.lower()
+        ground = asItemList(worldRooms[location][GROUND])
+        shop = asItemList(worldRooms[location].get(SHOP, []))
 
-        # get a list of all "description words" for each item in the inventory
-        invDescWords = getAllDescWords(inventory)
-        groundDescWords = getAllDescWords(worldRooms[location][GROUND])
-        shopDescWords = getAllDescWords(worldRooms[location].get(SHOP, []))
-
-        for npc in worldRooms[location][NPC]:
-            possibleItems.append(npc)
+        if commandComplete(line, [inventory.trie, ground.trie, shop.trie, directionTrie]):
+            return [] # command is complete
 
-        for descWord in invDescWords + groundDescWords + shopDescWords + [NORTH, SOUTH, EAST, WEST, UP, DOWN]:
-            if line.startswith('look %s' % (descWord)):
-                return [] # command is complete
+        # NPCs here whose names match the command text so far:
+        possibleItems = completeNames(lookingAt, worldRooms[location][NPC])
 
         # if the user has only typed "look" but no item name, show all items on ground, shop and directions:
         if lookingAt == '':
-            possibleItems.extend(getAllFirstDescWords(worldRooms[location][GROUND]))
-            possibleItems.extend(getAllFirstDescWords(worldRooms[location].get(SHOP, [])))
-            for direction in (NORTH, SOUTH, EAST, WEST, UP, DOWN):
+            possibleItems.extend(getAllFirstDescWords(ground))
+            possibleItems.extend(getAllFirstDescWords(shop))
+            for direction in DIRECTIONS:
                 if direction in worldRooms[location]:
                     possibleItems.append(direction)
             return list(set(possibleItems)) # make list unique
 
-        # otherwise, get a list of all "description words" for ground items matching the command text so far:
-        for descWord in groundDescWords:
-            if descWord.startswith(lookingAt):
-                possibleItems.append(descWord)
-
-        # otherwise, get a list of all "description words" for items for sale at the shop (if this is one):
-        for descWord in shopDescWords:
-            if descWord.startswith(lookingAt):
-                possibleItems.append(descWord)
-
-        # check for matching directions
-        for direction in (NORTH, SOUTH, EAST, WEST, UP, DOWN):
-            if direction.startswith(lookingAt):
-                possibleItems.append(direction)
-
-        # get a list of all "description words" for inventory items matching the command text so far:
-        for descWord in invDescWords:
-            if descWord.startswith(lookingAt):
-                possibleItems.append(descWord)
-
+        # otherwise, get the "description words" of ground, shop and inventory items, and the directions, matching the command text so far:
+        possibleItems.extend(completeWords(lookingAt, [ground, shop, inventory]))
+        possibleItems.extend(directionTrie.complete(lookingAt))
         return list(set(possibleItems)) # make list unique
 
 
@@ -2216,7 +3938,7 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
             if moneyAvailable >= costs:
                 playerStats['Money'] -= costs
                 inventory.append(item)
-                updatePlayers()
+                markPlayerDirty()
                 updatePrompt()
                 print('You have purchased %s' % (worldItems[item][SHORTDESC]))
                 print('You now have %d coins left' % (playerStats['Money']))
@@ -2233,19 +3955,13 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
             return []
 
         itemToBuy = text.lower()
-        possibleItems = []
 
         # if the user has only typed "buy" but no item name:
         if not itemToBuy:
             return getAllFirstDescWords(worldRooms[location][SHOP])
 
         # otherwise, get a list of all "description words" for shop items matching the command text so far:
-        for item in list(set(worldRooms[location][SHOP])):
-            for descWord in worldItems[item][DESCWORDS]:
-                if descWord.startswith(text):
-                    possibleItems.append(descWord)
-
-        return list(set(possibleItems)) # make list unique
+        return completeWords(itemToBuy, [worldRooms[location][SHOP]])
 
 
     def do_sell(self, arg):
@@ -2272,11 +3988,11 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
                 """for sellfor in range(sells):
                     inventory.append('Money')"""
                 playerStats['Money'] += sells
-                updatePlayers()
+                inventory.remove(item)
+                markPlayerDirty()
                 updatePrompt()
 
                 print('You have sold %s for %d coins' % (worldItems[item][SHORTDESC], sells))
-                inventory.remove(item)
                 return
 
         print('You do not have "%s". Type "inventory" or "inv" to see your inventory.' % (itemToSell))
@@ -2316,19 +4032,13 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
             return []
 
         itemToSell = text.lower()
-        possibleItems = []
 
         # if the user has only typed "sell" but no item name:
         if not itemToSell:
             return getAllFirstDescWords(inventory)
 
         # otherwise, get a list of all "description words" for inventory items matching the command text so far:
-        for item in list(set(inventory)):
-            for descWord in worldItems[item][DESCWORDS]:
-                if descWord.startswith(text):
-                    possibleItems.append(descWord)
-
-        return list(set(possibleItems)) # make list unique
+        return completeWords(itemToSell, [inventory])
 
 
     def do_eat(self, arg):
@@ -2350,7 +4060,7 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
             print('You eat %s' % (worldItems[item][SHORTDESC]))
             playerStats['Health'] += worldItems[item][GAIN]
             inventory.remove(item)
-            updatePlayers()
+            markPlayerDirty()
             updatePrompt()
             return
 
@@ -2362,22 +4072,42 @@ where read is to read a noticeboard and sign is to sign a noticeboard"""
 
     def complete_eat(self, text, line, begidx, endidx):
         itemToEat = text.lower()
-        possibleItems = []
 
         # if the user has only typed "eat" but no item name:
         if itemToEat == '':
             return getAllFirstDescWords(inventory)
 
         # otherwise, get a list of all "description words" for edible inventory items matching the command text so far:
-        for item in list(set(inventory)):
-            for descWord in worldItems[item][DESCWORDS]:
-                if descWord.startswith(text) and worldItems[item].get(EDIBLE, False):
-                    possibleItems.append(descWord)
-
-        return list(set(possibleItems)) # make list unique
+        return completeWords(itemToEat, [inventory], EDIBLE, False)
 
 
 if __name__ == '__main__':
+    if COMMAND == '--server':
+        runStateServer()
+        sys.exit(0)
+    if COMMAND == '--build-world':
+        with open(WORLD_FILE, 'rb') as f:
+            source = f.read()
+        buildWorld(source, hashlib.sha1(source).hexdigest())
+        print('Built %s and %s from %s (%d rooms, %d items, %d NPCs)' % (WORLD_ASSET, WORLD_CACHE, WORLD_FILE, len(worldRooms), len(worldItems), len(NPCs)))
+        sys.exit(0)
+    if COMMAND == '--generate-world':
+        args = [arg for arg in COMMAND_ARGS if arg != '--lazy']
+        roomCount = int(args[0])
+        seed = int(args[1]) if len(args) > 1 else 0
+        path = args[2] if len(args) > 2 else os.path.join(os.path.dirname(TOWN_WORLD_FILE), 'world-%d.json' % (roomCount))
+        generated = generateWorld(roomCount, seed, '--lazy' in COMMAND_ARGS)
+        with open(path, 'w') as f:
+            json.dump(generated, f)
+        print('Wrote %s (%d rooms, %d items, %d NPCs, %d room templates); play it with ADVENTURE_WORLD=%s' % (path, len(generated['worldRooms']), len(generated['worldItems']), len(generated['NPCs']), len(generated.get('roomTemplates', [])), path))
+        sys.exit(0)
+    if COMMAND == '--measure-world':
+        measureWorld()
+        sys.exit(0)
+    if COMMAND != None:
+        print('Unknown command %s, try --server, --build-world, --generate-world or --measure-world' % (COMMAND))
+        sys.exit(1)
+
     # Initialize 'colorama'
     colorama.init()
     print(WHITE)
@@ -2387,10 +4117,14 @@ if __name__ == '__main__':
     print('Welcome %s from IP %s on node %s' % (USERNAME, USERIPAD, NODENUMB))
     print('(Type "help" for commands.)')
     print()
+    if connectStateServer():
+        print('Connected to the state server.')
     placeRandoms()
+    openEventLog()
     updatePlayers()
     displayLocation(location)
     example = ThreadingExample()
+    watcher = EventWatcher()
     TextAdventureCmd().cmdloop()
     print('Thanks for playing!%s' % (WHITE))
 